@@ -5,7 +5,7 @@ __version__ = '1.0.36'
 
 # Import all the commands
 
-from .util import GitPanelWriteCommand, GitPanelAppendCommand
+from .util import GitPanelWriteCommand, GitPanelAppendCommand, GitPanelSetLineCommand
 
 from .repo import GitInitCommand, GitSwitchRepoCommand
 
@@ -13,15 +13,19 @@ from .custom import GitCustomCommand, GitCustomOutputCommand
 
 from .diff import (GitDiffCommand, GitDiffCachedCommand, GitDiffRefreshCommand, GitDiffMoveCommand,
                    GitDiffChangeHunkSizeCommand, GitDiffStageUnstageHunkCommand, GitDiffCurrentFileCommand,
-                   GitDiffCachedCurrentFileCommand, GitDiffEventListener)
+                   GitDiffCachedCurrentFileCommand, GitDiffWriteCommand, GitDiffExpandFileCommand,
+                   GitDiffHighlightWordsCommand, GitDiffEventListener)
 
-from .show import GitShowCommand, GitShowRefreshCommand
+from .show import GitShowCommand, GitShowRefreshCommand, GitShowExpandFileCommand
 
 from .help import GitHelpCommand, GitVersionCommand
 
 from .gc import GitGarbageCollectCommand
 
 from .log import GitLogCommand, GitQuickLogCommand, GitQuickLogCurrentFileCommand
+from .log import (GitLogGraphCommand, GitLogGraphRefreshCommand, GitLogGraphLoadMoreCommand,
+                  GitLogGraphWriteCommand, GitLogGraphShowCommand)
+from .log import GitLogGraphEventListener
 
 from .blame import (GitBlameCommand, GitBlameRefreshCommand, GitBlameShowCommand,
                     GitBlameBlameCommand)
@@ -30,14 +34,15 @@ from .blame import GitBlameEventListener
 from .remote import (GitPushCurrentBranchCommand, GitPullCurrentBranchCommand,
                      GitFetchCommand, GitPullCommand, GitPushCommand,
                      GitRemoteCommand, GitRemoteAddCommand)
+from .remote import GitAutoFetchEventListener
 
 from .status import (GitStatusCommand, GitStatusRefreshCommand, GitQuickStatusCommand,
-                     GitStatusMoveCommand, GitStatusStageCommand,
+                     GitStatusDiagnosticsCommand, GitStatusMoveCommand, GitStatusStageCommand,
                      GitStatusUnstageCommand, GitStatusDiscardCommand,
-                     GitStatusOpenFileCommand, GitStatusDiffCommand,
+                     GitStatusOpenFileCommand, GitStatusDiffCommand, GitStatusExpandCommand,
                      GitStatusIgnoreCommand, GitStatusStashCmd, GitStatusStashApplyCommand,
                      GitStatusStashPopCommand)
-from .status import GitStatusBarEventListener, GitStatusEventListener
+from .status import GitStatusBarEventListener, GitStatusEventListener, GitSaveEventListener
 
 from .add import GitQuickAddCommand, GitAddCurrentFileCommand
 
@@ -59,6 +64,8 @@ from .merge import GitMergeCommand
 
 from .gitk import GitGitkCommand
 
+from .running import GitRunningCommandsCommand
+
 from .sublimegit import (SublimeGitDocumentationCommand, SublimeGitVersionCommand)
 
 
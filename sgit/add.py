@@ -3,14 +3,14 @@ import sublime
 from sublime_plugin import WindowCommand, TextCommand
 
 from .cmd import GitCmd
-from .helpers import GitStatusHelper
+from .helpers import GitStatusSnapshotHelper
 
 GIT_ADD_CLEAN = "No unstaged changes"
 GIT_ADD_ALL = "+ All files"
 GIT_ADD_ALL_UNSTAGED = "+ All unstaged files"
 
 
-class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusHelper):
+class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusSnapshotHelper):
     """
     Adds one or more files to the staging area by selecting them
     from the quick bar.
@@ -62,19 +62,27 @@ class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusHelper):
             if line == GIT_ADD_CLEAN:
                 return
             elif line == GIT_ADD_ALL_UNSTAGED:
-                self.git(['add', '--update', '.'], cwd=repo)
-                sublime.status_message('Added all unstaged changes')
+                exit, _, stderr = self.git(['add', '--update', '.'], cwd=repo)
+                message = 'Added all unstaged changes'
             elif line == GIT_ADD_ALL:
-                self.git(['add', '--all'], cwd=repo)
-                sublime.status_message('Add all changes')
+                exit, _, stderr = self.git(['add', '--all'], cwd=repo)
+                message = 'Add all changes'
             else:
                 worktree, filename = status[idx][0], status[idx][2:]
                 if worktree == '?':
-                    self.git(['add', '--', filename], cwd=repo)
-                    sublime.status_message('Added %s' % filename)
+                    exit, _, stderr = self.git(['add', '--', filename], cwd=repo)
                 else:
-                    self.git(['add', '--update', '--', filename], cwd=repo)
-                    sublime.status_message('Added %s' % filename)
+                    exit, _, stderr = self.git(['add', '--update', '--', filename], cwd=repo)
+                message = 'Added %s' % filename
+                if exit == 0:
+                    self.stage_in_status_snapshot(repo, filename)
+
+            if exit == 0:
+                sublime.status_message(message)
+            else:
+                # the index may or may not have changed, so ask git next time
+                self.drop_status_snapshot(repo)
+                sublime.status_message(stderr.strip().split('\n')[0])
 
             def rerun():
                 self.window.run_command('git_quick_add', {'repo': repo})
@@ -83,7 +91,7 @@ class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusHelper):
         self.window.show_quick_panel(status, on_done, sublime.MONOSPACE_FONT)
 
     def get_status_list(self, repo):
-        status = [l[1:] for l in self.get_porcelain_status(repo) if l[1] != ' ']
+        status = [l[1:] for l in self.get_status_snapshot(repo) if l[1] != ' ']
         if not status:
             return [GIT_ADD_CLEAN]
         if len(status) > 1:
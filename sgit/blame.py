@@ -6,7 +6,7 @@ from sublime_plugin import TextCommand, WindowCommand, EventListener
 
 from .util import find_view_by_settings, get_setting
 from .cmd import GitCmd
-from .helpers import GitStatusHelper, GitRepoHelper
+from .helpers import GitStatusHelper, GitRepoHelper, GitCommitInfoHelper
 
 
 GIT_BLAME_TITLE_PREFIX = '*git-blame*: '
@@ -99,7 +99,7 @@ class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
         view.run_command('git_blame_refresh', {'filename': filename, 'revision': revision, 'rows': rows})
 
 
-class GitBlameRefreshCommand(TextCommand, GitCmd):
+class GitBlameRefreshCommand(TextCommand, GitCmd, GitCommitInfoHelper):
 
     HEADER_RE = re.compile(r'^(?P<sha>[0-9a-f]{40}) (\d+) (\d+) ?(\d+)?$')
 
@@ -154,6 +154,11 @@ class GitBlameRefreshCommand(TextCommand, GitCmd):
         for k in commits:
             commits[k]['abbrev'] = commits[k]['sha'][:abbrev_length]
 
+        # share the commit info with the other commands
+        for sha, c in commits.items():
+            if set(sha) != set(['0']) and 'summary' in c and 'author-time' in c:
+                self.add_commit_info(sha, c['summary'], c.get('author', ''), c.get('author-mail', ''), c['author-time'])
+
         return commits, lines
 
     def get_commit_date(self, commit):
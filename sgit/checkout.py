@@ -8,12 +8,16 @@ from .util import noop
 from .cmd import GitCmd
 from .helpers import GitStatusHelper, GitBranchHelper, GitErrorHelper, GitLogHelper, GitRemoteHelper
 from .helpers import GitTagHelper
+from .log import GitLogWindowCmd
 
 
 GIT_BRANCH_EXISTS_MSG = "The branch %s already exists. Do you want to overwrite it?"
 
 NO_REMOTES = u"No remotes have been configured. Remotes can be added with the Git: Add Remote command. Do you want to add a remote now?"
 
+REMOTE_BRANCHES_ALL = u'+ Show all branches'
+REMOTE_BRANCHES_ALL_DESC = u'Only the %s most recently updated branches are shown'
+
 class GitCheckoutWindowCmd(GitCmd, GitBranchHelper, GitLogHelper, GitErrorHelper):
     pass
 
@@ -52,6 +56,7 @@ class GitCheckoutBranchCommand(WindowCommand, GitCheckoutWindowCmd):
             panel = self.window.get_output_panel('git-checkout')
             panel.run_command('git_panel_write', {'content': stderr})
             self.window.run_command('show_panel', {'panel': 'output.git-checkout'})
+            self.warm_ref_catalog(repo)
         else:
             sublime.error_message(self.format_error_message(stderr))
         self.window.run_command('git_status', {'refresh_only': True})
@@ -95,12 +100,13 @@ class GitCheckoutTagCommand(WindowCommand, GitCheckoutWindowCmd, GitTagHelper):
             panel = self.window.get_output_panel('git-checkout')
             panel.run_command('git_panel_write', {'content': stderr})
             self.window.run_command('show_panel', {'panel': 'output.git-checkout'})
+            self.warm_ref_catalog(repo)
         else:
             sublime.error_message(self.format_error_message(stderr))
         self.window.run_command('git_status', {'refresh_only': True})
 
 
-class GitCheckoutCommitCommand(WindowCommand, GitCheckoutWindowCmd):
+class GitCheckoutCommitCommand(WindowCommand, GitCheckoutWindowCmd, GitLogWindowCmd):
     """
     Check out a specific commit.
 
@@ -117,20 +123,15 @@ class GitCheckoutCommitCommand(WindowCommand, GitCheckoutWindowCmd):
         if not repo:
             return
 
-        log = self.get_quick_log(repo)
-        hashes, choices = self.format_quick_log(log)
-        self.window.show_quick_panel(choices, partial(self.on_done, repo, hashes))
+        self.show_quick_log(self.window, repo, partial(self.on_done, repo))
 
-    def on_done(self, repo, hashes, idx):
-        if idx == -1:
-            return
-
-        commit = hashes[idx]
+    def on_done(self, repo, commit):
         exit, stdout, stderr = self.git(['checkout', commit], cwd=repo)
         if exit == 0:
             panel = self.window.get_output_panel('git-checkout')
             panel.run_command('git_panel_write', {'content': stderr})
             self.window.run_command('show_panel', {'panel': 'output.git-checkout'})
+            self.warm_ref_catalog(repo)
         else:
             sublime.error_message(self.format_error_message(stderr))
         self.window.run_command('git_status', {'refresh_only': True})
@@ -175,6 +176,7 @@ class GitCheckoutNewBranchCommand(WindowCommand, GitCheckoutWindowCmd):
             panel = self.window.get_output_panel('git-checkout')
             panel.run_command('git_panel_write', {'content': stderr})
             self.window.run_command('show_panel', {'panel': 'output.git-checkout'})
+            self.warm_ref_catalog(repo)
         else:
             sublime.error_message(self.format_error_message(stderr))
         self.window.run_command('git_status', {'refresh_only': True})
@@ -196,11 +198,16 @@ class GitCheckoutRemoteBranchCommand(WindowCommand, GitCheckoutWindowCmd, GitRem
         choices = self.format_quick_remotes(remotes)
         self.window.show_quick_panel(choices, partial(self.remote_panel_done, repo, choices))
 
-    def remote_panel_done(self, repo, choices, idx):
+    def remote_panel_done(self, repo, choices, idx, show_all=False):
         if idx != -1:
             remote = choices[idx][0]
 
-            remote_branches = self.get_remote_branches(repo, remote)
+            limit = None if show_all else self.get_remote_branch_limit()
+            # ask for one more, to know whether any are left out
+            remote_branches = self.get_remote_branches(repo, remote, limit=limit + 1 if limit else None)
+            more = limit and len(remote_branches) > limit
+            if more:
+                remote_branches = remote_branches[:limit]
             if not remote_branches:
                 return sublime.error_message("No branches on remote %s" % remote)
 
@@ -208,11 +215,20 @@ class GitCheckoutRemoteBranchCommand(WindowCommand, GitCheckoutWindowCmd, GitRem
             local_branches = [b for _, b in self.get_branches(repo)]
             remote_only_branches = [b for b in formatted_remote_branches if b[0] not in frozenset(local_branches)]
 
-            if not remote_only_branches:
+            if not remote_only_branches and not more:
                 return sublime.error_message("All remote branches are already present locally")
 
+            def on_done(branch_idx):
+                if branch_idx == len(remote_only_branches):
+                    self.remote_panel_done(repo, choices, idx, show_all=True)
+                else:
+                    self.remote_branch_panel_done(repo, remote_only_branches, branch_idx)
+
             def on_remote():
-                self.window.show_quick_panel(remote_only_branches, partial(self.remote_branch_panel_done, repo, remote_only_branches))
+                branch_choices = list(remote_only_branches)
+                if more:
+                    branch_choices.append([REMOTE_BRANCHES_ALL, REMOTE_BRANCHES_ALL_DESC % limit])
+                self.window.show_quick_panel(branch_choices, on_done)
 
             sublime.set_timeout(on_remote, 50)
 
@@ -225,6 +241,7 @@ class GitCheckoutRemoteBranchCommand(WindowCommand, GitCheckoutWindowCmd, GitRem
                 panel = self.window.get_output_panel('git-checkout')
                 panel.run_command('git_panel_write', {'content': stderr})
                 self.window.run_command('show_panel', {'panel': 'output.git-checkout'})
+                self.warm_ref_catalog(repo)
             else:
                 sublime.error_message(self.format_error_message(stderr))
             self.window.run_command('git_status', {'refresh_only': True})
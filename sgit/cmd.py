@@ -1,8 +1,12 @@
 # coding: utf-8
 import os
+import re
 import sys
+import copy
+import time
 import subprocess
 import logging
+import itertools
 import threading
 import webbrowser
 from datetime import datetime
@@ -10,7 +14,7 @@ from functools import partial
 
 import sublime
 
-from .util import get_executable, get_setting, text_type
+from .util import get_setting, text_type
 from .helpers import GitRepoHelper
 
 
@@ -21,6 +25,257 @@ class SublimeGitException(Exception):
     pass
 
 
+class OutputBatcher(object):
+    """
+    Hands output from a background command to a callback on the main
+    thread in batches, instead of scheduling a callback for every line.
+    Output is delivered at most INTERVAL ms after it was produced, or
+    right away once SIZE characters have piled up.
+    """
+
+    INTERVAL = 50  # ms
+    SIZE = 65536
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending = []
+        self.size = 0
+        self.scheduled = False
+
+    def add(self, text):
+        with self.lock:
+            self.pending.append(text)
+            self.size += len(text)
+            if self.size >= self.SIZE:
+                delay = 0
+            elif not self.scheduled:
+                delay = self.INTERVAL
+            else:
+                return
+            self.scheduled = True
+        sublime.set_timeout(self.flush, delay)
+
+    def close(self):
+        sublime.set_timeout(self.flush, 0)
+
+    def flush(self):
+        with self.lock:
+            text = u''.join(self.pending)
+            self.pending, self.size, self.scheduled = [], 0, False
+        if text:
+            self.callback(text)
+
+
+class GitProgress(object):
+    """
+    Turns the progress meters git writes with --progress, like
+    "Receiving objects:  45% (450/1000), 1.20 MiB | 2.40 MiB/s", into
+    progress events.
+
+    An event is a dict with the phase, the percent done, the current and
+    total object counts, the bytes transferred, the throughput in bytes
+    per second, an estimate of the seconds left in the phase and whether
+    the phase is done. Anything git doesn't report is None.
+    """
+
+    PROGRESS_RE = re.compile(r'^(?:remote: )?(?P<phase>[A-Z][a-z]+(?: [a-z]+)*):\s+'
+                             r'(?:(?P<percent>\d+)% \((?P<current>\d+)/(?P<total>\d+)\)|(?P<count>\d+))'
+                             r'(?:, (?P<bytes>[\d.]+ (?:bytes|[KMGT]iB))(?: \| (?P<throughput>[\d.]+ (?:bytes|[KMGT]iB))/s)?)?'
+                             r'(?P<done>, done\.)?')
+    UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+    def __init__(self):
+        self.phase = None
+        self.started = None
+
+    def parse_size(self, size):
+        if not size:
+            return None
+        value, unit = size.split(' ')
+        return int(float(value) * self.UNITS[unit])
+
+    def parse(self, line):
+        match = self.PROGRESS_RE.match(line.strip())
+        if not match:
+            return None
+
+        now = time.time()
+        phase = match.group('phase')
+        if phase != self.phase:
+            self.phase, self.started = phase, now
+
+        percent = int(match.group('percent')) if match.group('percent') else None
+        done = bool(match.group('done'))
+
+        # only guess once the phase has been going for a while
+        eta = None
+        elapsed = now - self.started
+        if percent and percent < 100 and not done and elapsed >= 1:
+            eta = int(elapsed * (100 - percent) / percent)
+
+        return {
+            'phase': phase,
+            'percent': percent,
+            'current': int(match.group('current') or match.group('count')),
+            'total': int(match.group('total')) if match.group('total') else None,
+            'bytes': self.parse_size(match.group('bytes')),
+            'throughput': self.parse_size(match.group('throughput')),
+            'eta': eta,
+            'done': done
+        }
+
+    def feed(self, text):
+        """Return the latest progress event in a chunk of output, if any."""
+        event = None
+        for line in re.split(r'[\r\n]', text):
+            event = self.parse(line) or event
+        return event
+
+
+class CommandJob(object):
+    """
+    An async command, queued or running on the CommandExecutor.
+
+    Quacks enough like a thread (start, is_alive, join) to be handed
+    to a StatusSpinner.
+    """
+
+    QUEUED, RUNNING, DONE, CANCELLED = 'queued', 'running', 'done', 'cancelled'
+
+    def __init__(self, target, description, repo, priority, exclusive):
+        self.target = target
+        self.description = description
+        self.repo = repo
+        self.priority = priority
+        self.exclusive = exclusive
+        self.state = None
+        self.proc = None
+        self.cancelled = False
+        self.queued_at = self.started_at = None
+        self.finished = threading.Event()
+
+    def start(self):
+        CommandExecutor.submit(self)
+
+    def is_alive(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    def join(self, timeout=None):
+        self.finished.wait(timeout)
+
+    def cancel(self):
+        CommandExecutor.cancel(self)
+
+
+class CommandExecutor(object):
+    """
+    Runs async commands on a bounded set of worker threads.
+
+    Jobs are picked by priority, then in the order they were started.
+    Background jobs never take the last free worker, so interactive
+    commands don't wait behind them, and jobs which take the index lock
+    run one at a time per repository, under the same RepoLock as the
+    commands which are run directly.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 10
+
+    lock = threading.Lock()
+    queue = []
+    running = []
+    workers = 0
+    size = 4
+    counter = itertools.count()
+
+    @classmethod
+    def submit(cls, job):
+        size = max(2, get_setting('git_command_workers', 4))
+        with cls.lock:
+            cls.size = size
+            job.state, job.queued_at = job.QUEUED, time.time()
+            cls.queue.append((job.priority, next(cls.counter), job))
+            spawn = cls.workers < cls.size
+            if spawn:
+                cls.workers += 1
+        if spawn:
+            worker = threading.Thread(target=cls.work)
+            worker.daemon = True
+            worker.start()
+
+    @classmethod
+    def cancel(cls, job):
+        with cls.lock:
+            job.cancelled = True
+            if job.state == job.QUEUED:
+                cls.queue = [q for q in cls.queue if q[2] is not job]
+                job.state = job.CANCELLED
+                job.finished.set()
+            elif job.state == job.RUNNING and job.proc and job.proc.poll() is None:
+                job.proc.kill()
+
+    @classmethod
+    def jobs(cls):
+        """Running jobs, then queued jobs in the order they will run."""
+        with cls.lock:
+            return list(cls.running) + [q[2] for q in sorted(cls.queue, key=lambda q: q[:2])]
+
+    @classmethod
+    def next_job(cls):
+        locked = set(j.repo for j in cls.running if j.exclusive)
+        for entry in sorted(cls.queue, key=lambda q: q[:2]):
+            job = entry[2]
+            if job.exclusive and job.repo in locked:
+                continue
+            if job.priority >= cls.BACKGROUND and len(cls.running) >= cls.size - 1:
+                continue
+            cls.queue.remove(entry)
+            return job
+
+    @classmethod
+    def work(cls):
+        while True:
+            with cls.lock:
+                job = cls.next_job()
+                if not job:
+                    # anything left is waiting for a running job, whose worker will pick it up
+                    cls.workers -= 1
+                    return
+                job.state, job.started_at = job.RUNNING, time.time()
+                cls.running.append(job)
+
+            try:
+                job.target(job)
+            except Exception:
+                logger.exception('Async command failed: %s', job.description)
+            finally:
+                with cls.lock:
+                    cls.running.remove(job)
+                    job.state = job.CANCELLED if job.cancelled else job.DONE
+                job.finished.set()
+
+
+class RepoLock(object):
+    """
+    One lock per repository, held while a command which writes the
+    index runs, whether it was run directly or on the CommandExecutor.
+    Read-only commands never take it. Nobody waits for it for long:
+    the main thread gives up after a moment, other threads after a few
+    seconds, and the command is refused with REPO_BUSY.
+    """
+
+    locks = {}
+    registry = threading.Lock()
+
+    @classmethod
+    def get(cls, repo):
+        with cls.registry:
+            if repo not in cls.locks:
+                cls.locks[repo] = threading.Lock()
+            return cls.locks[repo]
+
+
 class Cmd(object):
     started_at = datetime.today()
     last_popup_at = None
@@ -29,6 +284,33 @@ class Cmd(object):
     bin = []
     opts = []
 
+    # settings read on the main thread, for commands run by a worker
+    cmd_settings = None
+    CMD_SETTINGS = ('encoding', 'fallback_encodings', 'git_executables', 'git_force_path')
+
+    # settings helpers
+    def read_settings(self, *keys):
+        return dict((key, get_setting(key)) for key in self.CMD_SETTINGS + keys)
+
+    def setting(self, key, default=None):
+        if self.cmd_settings is not None and key in self.cmd_settings:
+            value = self.cmd_settings[key]
+        else:
+            value = get_setting(key)
+        return default if value is None else value
+
+    def worker(self, *keys):
+        """
+        Return a copy of this command for running git on a worker thread.
+
+        Sublime Text 2 only allows the API on the main thread, so the
+        settings the commands depend on, and any other settings given,
+        are read right away.
+        """
+        worker = copy.copy(self)
+        worker.cmd_settings = self.read_settings(*keys)
+        return worker
+
     # cmd helpers
     def _string(self, cmd, strip=True, *args, **kwargs):
         _, stdout, _ = self.cmd(cmd, *args, **kwargs)
@@ -45,13 +327,16 @@ class Cmd(object):
         exit, _, _ = self.cmd(cmd, *args, **kwargs)
         return exit
 
+    def get_opts(self):
+        return self.opts
+
     def build_command(self, cmd):
-        bin = get_executable(self.executable, self.bin)
-        return bin + self.opts + [c for c in cmd if c]
+        bin = self.setting('git_executables', {}).get(self.executable, self.bin)
+        return bin + self.get_opts() + [c for c in cmd if c]
 
     def env(self):
         env = os.environ.copy()
-        path = get_setting('git_force_path', [])
+        path = self.setting('git_force_path', [])
         if path:
             if isinstance(path, list):
                 env['PATH'] = os.pathsep.join(path)
@@ -82,12 +367,44 @@ class Cmd(object):
                         pass
             raise
 
+    def takes_index_lock(self, cmd):
+        # we can't tell what wrapper tools do, so assume the worst
+        return True
+
     # sync commands
+
+    # another git process holds a lock file, so just try again a bit later
+    LOCK_ERROR_RE = re.compile(br"Unable to create '[^']*\.lock': File exists")
+    LOCK_RETRY_DELAYS = (0.05, 0.1, 0.2, 0.4, 0.8, 1.6)
+    # the main thread only waits for a moment, so the UI doesn't freeze
+    MAIN_THREAD_RETRY_DELAYS = (0.01, 0.02, 0.05, 0.1, 0.2)
+    LOCK_RETRY_MESSAGE = u"Another git process is using the repository, trying again in %ss\n"
+
+    REPO_BUSY = u"Another git command is changing the repository, please try again in a moment"
+    REPO_BUSY_EXIT = 128
+
+    def on_main_thread(self):
+        return threading.current_thread().name == 'MainThread'
+
+    def get_retry_delays(self):
+        return self.MAIN_THREAD_RETRY_DELAYS if self.on_main_thread() else self.LOCK_RETRY_DELAYS
+
+    def acquire_repo_lock(self, lock, delays):
+        # Lock.acquire can't time out in Python 2, so poll with backoff
+        for delay in delays + (None,):
+            if lock.acquire(False):
+                return True
+            if delay is None:
+                return False
+            time.sleep(delay)
+
     def cmd(self, cmd, stdin=None, cwd=None, ignore_errors=False, encoding=None, fallback=None):
         command = self.build_command(cmd)
         environment = self.env()
-        encoding = encoding or get_setting('encoding', 'utf-8')
-        fallback = fallback or get_setting('fallback_encodings', [])
+        encoding = encoding or self.setting('encoding', 'utf-8')
+        fallback = fallback or self.setting('fallback_encodings', [])
+        lock = RepoLock.get(cwd) if cwd and self.takes_index_lock(cmd) else None
+        delays = self.get_retry_delays()
 
         try:
             logger.debug("cmd: %s", command)
@@ -95,16 +412,29 @@ class Cmd(object):
             if stdin and hasattr(stdin, 'encode'):
                 stdin = stdin.encode(encoding)
 
-            if cwd:
-                os.chdir(cwd)
-
-            proc = subprocess.Popen(command,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    startupinfo=self.startupinfo(),
-                                    env=environment)
-            stdout, stderr = proc.communicate(stdin)
+            for delay in delays + (None,):
+                if lock and not self.acquire_repo_lock(lock, delays):
+                    logger.debug("repository busy: %s", command)
+                    if self.on_main_thread():
+                        sublime.status_message(self.REPO_BUSY)
+                    return (self.REPO_BUSY_EXIT, u'', self.REPO_BUSY)
+                try:
+                    proc = subprocess.Popen(command,
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            startupinfo=self.startupinfo(),
+                                            env=environment,
+                                            cwd=cwd)
+                    stdout, stderr = proc.communicate(stdin)
+                finally:
+                    if lock:
+                        lock.release()
+
+                if delay is None or proc.returncode == 0 or not self.LOCK_ERROR_RE.search(stderr):
+                    break
+                logger.debug("lock contention, retrying in %ss: %s", delay, command)
+                time.sleep(delay)
 
             logger.debug("out: (%s) %s", proc.returncode, [stdout[:100]])
 
@@ -120,48 +450,142 @@ class Cmd(object):
             sublime.error_message(self.get_decoding_error(encoding, fallback))
             raise SublimeGitException("Could not execute command: %s" % command)
 
-    # async commands
-    def cmd_async(self, cmd, cwd=None, **callbacks):
+    # streaming commands
+    def cmd_stream(self, cmd, cwd=None, stdin=None, encoding=None, fallback=None):
         command = self.build_command(cmd)
         environment = self.env()
-        encoding = get_setting('encoding', 'utf-8')
-        fallback = get_setting('fallback_encodings', [])
+        encoding = encoding or self.setting('encoding', 'utf-8')
+        fallback = fallback or self.setting('fallback_encodings', [])
 
-        def async_inner(cmd, cwd, encoding, on_data=None, on_complete=None, on_error=None, on_exception=None):
-            try:
-                logger.debug('async-cmd: %s', cmd)
+        if stdin and hasattr(stdin, 'encode'):
+            stdin = stdin.encode(encoding)
 
-                if cwd:
-                    os.chdir(cwd)
+        def stream_inner():
+            logger.debug('stream-cmd: %s', command)
 
-                proc = subprocess.Popen(cmd,
+            devnull = open(os.devnull, 'wb')
+            try:
+                proc = subprocess.Popen(command,
+                                        stdin=subprocess.PIPE if stdin else None,
                                         stdout=subprocess.PIPE,
-                                        stderr=subprocess.STDOUT,
+                                        stderr=devnull,
                                         startupinfo=self.startupinfo(),
-                                        env=environment)
+                                        env=environment,
+                                        cwd=cwd)
+            except OSError as e:
+                devnull.close()
+                logger.debug('stream-exception: %s', e)
+                raise SublimeGitException(self.get_executable_error())
 
+            try:
+                if stdin:
+                    # only for commands which read all of stdin before writing anything
+                    proc.stdin.write(stdin)
+                    proc.stdin.close()
                 for line in iter(proc.stdout.readline, b''):
-                    logger.debug('async-out: %s', line.strip())
-                    line = self.decode(line, encoding, fallback)
-                    if callable(on_data):
-                        sublime.set_timeout(partial(on_data, line), 0)
-
+                    try:
+                        yield self.decode(line, encoding, fallback)
+                    except UnicodeDecodeError:
+                        raise SublimeGitException(self.get_decoding_error(encoding, fallback))
                 proc.wait()
-                logger.debug('async-exit: %s', proc.returncode)
-                if proc.returncode == 0:
+                logger.debug('stream-exit: %s', proc.returncode)
+            finally:
+                # the consumer may stop reading early, so make sure we don't leave git hanging
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+                devnull.close()
+
+        return stream_inner()
+
+    # async commands
+    def cmd_async(self, cmd, cwd=None, priority=CommandExecutor.INTERACTIVE, **callbacks):
+        command = self.build_command(cmd)
+        environment = self.env()
+        encoding = self.setting('encoding', 'utf-8')
+        fallback = self.setting('fallback_encodings', [])
+
+        def async_inner(cmd, cwd, encoding, job, on_data=None, on_progress=None, on_complete=None, on_error=None,
+                        on_exception=None):
+            lock = RepoLock.get(cwd) if cwd and job.exclusive else None
+            try:
+                logger.debug('async-cmd: %s', cmd)
+
+                # read whatever is available, so progress lines ending in \r show up right away
+                batcher = OutputBatcher(on_data) if callable(on_data) else None
+                progress = GitProgress() if callable(on_progress) else None
+
+                for delay in self.LOCK_RETRY_DELAYS + (None,):
+                    if lock and not self.acquire_repo_lock(lock, self.LOCK_RETRY_DELAYS):
+                        logger.debug('repository busy: %s', cmd)
+                        if batcher:
+                            batcher.add(self.REPO_BUSY + u'\n')
+                        returncode = self.REPO_BUSY_EXIT
+                        break
+                    try:
+                        proc = subprocess.Popen(cmd,
+                                                stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT,
+                                                startupinfo=self.startupinfo(),
+                                                env=environment,
+                                                cwd=cwd)
+                        with CommandExecutor.lock:
+                            job.proc = proc
+                            if job.cancelled:
+                                proc.kill()
+
+                        fd, buf, locked = proc.stdout.fileno(), b'', False
+                        while True:
+                            chunk = os.read(fd, 65536)
+                            if chunk:
+                                buf += chunk
+                            end = len(buf) if not chunk else max(buf.rfind(b'\n'), buf.rfind(b'\r')) + 1
+                            if end:
+                                out, buf = buf[:end], buf[end:]
+                                logger.debug('async-out: %s', out.strip())
+                                locked = locked or bool(self.LOCK_ERROR_RE.search(out))
+                            # only the last try reports the lock error
+                            if end and not (locked and delay is not None):
+                                out = self.decode(out, encoding, fallback)
+                                if batcher:
+                                    batcher.add(out)
+                                event = progress.feed(out) if progress else None
+                                if event:
+                                    sublime.set_timeout(partial(on_progress, event), 0)
+                            if not chunk:
+                                break
+                        returncode = proc.wait()
+                    finally:
+                        if lock:
+                            lock.release()
+
+                    if delay is None or returncode == 0 or not locked or job.cancelled:
+                        break
+                    logger.debug("lock contention, retrying in %ss: %s", delay, cmd)
+                    if batcher:
+                        batcher.add(self.LOCK_RETRY_MESSAGE % delay)
+                    time.sleep(delay)
+
+                if batcher:
+                    batcher.close()
+
+                logger.debug('async-exit: %s', returncode)
+                if returncode == 0:
                     if callable(on_complete):
-                        sublime.set_timeout(partial(on_complete, proc.returncode), 0)
+                        sublime.set_timeout(partial(on_complete, returncode), 0)
                 else:
                     if callable(on_error):
-                        sublime.set_timeout(partial(on_error, proc.returncode), 0)
+                        sublime.set_timeout(partial(on_error, returncode), 0)
 
             except (OSError, UnicodeDecodeError) as e:
                 logger.debug('async-exception: %s' % e)
                 if callable(on_exception):
                     sublime.set_timeout(partial(on_exception, e), 0)
 
-        thread = threading.Thread(target=partial(async_inner, command, cwd, encoding, **callbacks))
-        return thread
+        description = " ".join(self.bin + [c for c in cmd if c])
+        return CommandJob(lambda job: async_inner(command, cwd, encoding, job, **callbacks),
+                          description, cwd, priority, self.takes_index_lock(cmd))
 
     # messages
     EXECUTABLE_ERROR = ("Executable '{bin}' was not found in PATH. Current PATH:\n\n"
@@ -199,6 +623,41 @@ class GitCmd(GitRepoHelper, Cmd):
         '-c', 'core.commentchar=#',
     ]
 
+    # let status skip scanning directories and stat'ing files which haven't changed
+    FAST_STATUS_OPTS = [
+        '-c', 'core.untrackedCache=true',
+        '-c', 'core.fsmonitor=true',
+    ]
+
+    CMD_SETTINGS = Cmd.CMD_SETTINGS + ('git_fast_status',)
+
+    def get_opts(self):
+        if self.setting('git_fast_status', False):
+            return self.opts + self.FAST_STATUS_OPTS
+        return self.opts
+
+    GIT_VERSION_RE = re.compile(r'(\d+)\.(\d+)(?:\.(\d+))?')
+
+    # version of git as a tuple of numbers, indexed by the git executable
+    versions = {}
+
+    def get_git_version(self):
+        key = tuple(self.setting('git_executables', {}).get(self.executable, self.bin))
+        if key not in GitCmd.versions:
+            match = self.GIT_VERSION_RE.search(self.git_string(['--version']))
+            GitCmd.versions[key] = tuple(int(n or 0) for n in match.groups()) if match else ()
+        return GitCmd.versions[key]
+
+    # subcommands which take .git/index.lock or rewrite the working tree. pull and gc spend
+    # most of their time on the network and on packing, so they rely on retrying instead.
+    INDEX_LOCK_COMMANDS = ('add', 'am', 'apply', 'checkout', 'cherry-pick', 'clean', 'commit',
+                           'merge', 'mv', 'rebase', 'reset', 'restore', 'revert', 'rm',
+                           'stash', 'switch', 'update-index')
+
+    def takes_index_lock(self, cmd):
+        subcommand = next((c for c in cmd if c and not c.startswith('-')), None)
+        return subcommand in self.INDEX_LOCK_COMMANDS
+
     def git(self, cmd, *args, **kwargs):
         return self.cmd(cmd, *args, **kwargs)
 
@@ -211,6 +670,9 @@ class GitCmd(GitRepoHelper, Cmd):
     def git_exit_code(self, cmd, *args, **kwargs):
         return self._exit_code(cmd, *args, **kwargs)
 
+    def git_stream(self, cmd, *args, **kwargs):
+        return self.cmd_stream(cmd, *args, **kwargs)
+
     def git_async(self, cmd, *args, **kwargs):
         return self.cmd_async(cmd, *args, **kwargs)
 
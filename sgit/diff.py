@@ -1,16 +1,25 @@
 # coding: utf-8
+import os
 import re
+import time
+import difflib
+import logging
+import threading
 from functools import partial
 
 import sublime
 from sublime_plugin import WindowCommand, TextCommand, EventListener
 
 from .util import find_view_by_settings, get_setting
-from .cmd import GitCmd
-from .helpers import GitDiffHelper, GitErrorHelper, GitStatusHelper
+from .cmd import GitCmd, SublimeGitException
+from .helpers import GitDiffHelper, GitErrorHelper, GitStatusHelper, GitRepoStateHelper, GitIndexRefreshCache
+
+
+logger = logging.getLogger('SublimeGit.diff')
 
 
 RE_DIFF_HEAD = re.compile(r'(---|\+\+\+){3} (a|b)/(dev/null)?')
+RE_DIFF_TOKEN = re.compile(r'\w+|\s+|[^\w\s]', re.UNICODE)
 
 
 GIT_DIFF_TITLE = '*git-diff*'
@@ -26,6 +35,21 @@ GIT_DIFF_VIEW_SYNTAX = 'Packages/SublimeGit/syntax/SublimeGit Diff.tmLanguage'
 GIT_DIFF_UNSTAGE_ERROR = "Cannot unstage hunks which have not been staged."
 GIT_DIFF_STAGE_ERROR = "Cannot stage hunks which are already staged."
 
+GIT_DIFF_FILE_HEADERS = ('diff --git', 'diff --cc')
+GIT_DIFF_COLLAPSED_PREFIX = u"# Collapsed"
+GIT_DIFF_COLLAPSED = GIT_DIFF_COLLAPSED_PREFIX + u" large diff ({lines} lines, {size} bytes), press e to expand: {path}\n"
+GIT_DIFF_SUMMARY = GIT_DIFF_COLLAPSED_PREFIX + u" ({stat}), press e to expand: {path}\n"
+
+
+class GitDiffCache(object):
+    # context and fingerprint of the repository state from the last refresh, indexed by view id
+    fingerprints = {}
+    hits = 0
+    misses = 0
+
+    # raw diff lines and their context size from the last refresh, indexed by view id
+    contexts = {}
+
 
 class GitDiffCommand(WindowCommand, GitCmd):
     """
@@ -36,6 +60,16 @@ class GitDiffCommand(WindowCommand, GitCmd):
 
     For diff on a single file, either use the **Git: Quick Status** command,
     or press ``d`` when the cursor is on a file in the status view.
+
+    If the diff contains a lot of files, each file will start out collapsed
+    to a single line. Press ``e`` on a file to load the diff for that file.
+    Files with a very large diff are collapsed in the same way. Files which
+    have been expanded stay expanded when the diff is refreshed.
+
+    :setting git_diff_summary_threshold: The number of files above which
+        the diff starts out collapsed. Set to ``0`` to always show the full diff.
+    :setting git_diff_collapse_threshold: The size in bytes above which
+        the diff for a single file is collapsed. Set to ``0`` to never collapse.
     """
 
     def run(self, repo=None, path=None, cached=False):
@@ -123,7 +157,7 @@ class GitDiffCachedCurrentFileCommand(GitDiffCurrentFileCommand):
         super(GitDiffCachedCurrentFileCommand, self).run(edit, cached=True)
 
 
-class GitDiffTextCmd(GitCmd, GitDiffHelper):
+class GitDiffTextCmd(GitCmd, GitDiffHelper, GitRepoStateHelper):
 
     def move_to_point(self, point):
         self.view.sel().clear()
@@ -159,6 +193,7 @@ class GitDiffTextCmd(GitCmd, GitDiffHelper):
 
                 current_file = line
                 current_hunks = []
+                current_hunk = None
             elif state == 'header' and RE_DIFF_HEAD.match(linetext):
                 current_file = current_file.cover(line)
             elif linetext.startswith('@@'):
@@ -175,8 +210,9 @@ class GitDiffTextCmd(GitCmd, GitDiffHelper):
             elif state == 'header':
                 current_file = current_file.cover(line)
 
-        if current_file and current_hunk:
-            current_hunks.append(current_hunk)
+        if current_file:
+            if current_hunk:
+                current_hunks.append(current_hunk)
             sections.append((current_file, current_hunks))
         return sections
 
@@ -203,6 +239,56 @@ class GitDiffTextCmd(GitCmd, GitDiffHelper):
 
         return hunks
 
+    def get_fingerprint(self, repo, path, cached):
+        fingerprint = [self.get_index_fingerprint(repo), self.get_head_fingerprint(repo)]
+        if not cached:
+            fingerprint.append(GitIndexRefreshCache.saves)
+            if os.path.isdir(os.path.join(repo, path)):
+                # files changed outside of Sublime Text aren't counted as saves, so ask git
+                # which files differ from the index, which only takes a stat of each file
+                for p in self.get_changed_paths(repo, path):
+                    fingerprint.append((p, self.get_stat_fingerprint(os.path.join(repo, p))))
+            else:
+                fingerprint.append(self.get_stat_fingerprint(os.path.join(repo, path)))
+        return fingerprint
+
+    def get_changed_paths(self, repo, path):
+        output = self.git_string(['diff', '--name-only', '-z', '--no-renames', '--', path], cwd=repo, strip=False)
+        return sorted(p for p in output.split('\x00') if p)
+
+    def find_file_header(self, line):
+        while line.begin() > 0 and not self.view.substr(line).startswith(GIT_DIFF_FILE_HEADERS):
+            line = self.view.line(line.begin() - 1)
+        return line
+
+    def find_collapsed_file(self, line):
+        linetext = self.view.substr(line)
+        if linetext.startswith(GIT_DIFF_COLLAPSED_PREFIX):
+            header = self.find_file_header(line)
+            region = sublime.Region(header.begin(), self.view.full_line(line).end())
+            return (region, linetext.split(': ', 1)[1])
+        elif linetext.startswith(GIT_DIFF_FILE_HEADERS):
+            # look through the file header for a collapse marker
+            header = line
+            while line.end() < self.view.size():
+                line = self.view.line(line.end() + 1)
+                linetext = self.view.substr(line)
+                if linetext.startswith(GIT_DIFF_COLLAPSED_PREFIX):
+                    region = sublime.Region(header.begin(), self.view.full_line(line).end())
+                    return (region, linetext.split(': ', 1)[1])
+                elif linetext.startswith('@@') or linetext.startswith(GIT_DIFF_FILE_HEADERS):
+                    break
+
+    def get_collapsed_from_selection(self, selection):
+        collapsed = {}
+        for s in selection:
+            for line in self.view.lines(s):
+                found = self.find_collapsed_file(line)
+                if found:
+                    region, path = found
+                    collapsed[region.begin()] = (region, path)
+        return [collapsed[k] for k in sorted(collapsed.keys())]
+
     def create_patch(self, selected_hunks):
         patch = []
         for (hstart, hend), hunks in selected_hunks.items():
@@ -218,12 +304,272 @@ class GitDiffTextCmd(GitCmd, GitDiffHelper):
         return "".join(patch)
 
 
+class GitDiffWorker(threading.Thread):
+    """
+    Base class for background work on a diff view. Only the most
+    recently started worker of each kind is current for a view, and
+    callbacks dispatched from stale workers are dropped.
+    """
+
+    # the current worker for each view, indexed by id (override in subclasses)
+    workers = {}
+
+    def __init__(self, view):
+        super(GitDiffWorker, self).__init__()
+        self.daemon = True
+        self.view = view
+        self.view_id = view.id()
+
+    def start(self):
+        self.__class__.workers[self.view_id] = self
+        super(GitDiffWorker, self).start()
+
+    def is_current(self):
+        return self.__class__.workers.get(self.view_id) is self
+
+    def dispatch(self, func, *args):
+        def inner():
+            if self.is_current():
+                func(*args)
+        sublime.set_timeout(inner, 0)
+
+    def discard(self):
+        self.__class__.workers.pop(self.view_id, None)
+
+
+class GitDiffStream(GitDiffWorker):
+    """
+    Reads the output of git diff on a background thread, and writes it
+    to a diff view in batches, so that huge diffs don't block the UI.
+
+    Files with a diff larger than the threshold (in bytes) are collapsed
+    to their header and a one-line summary, which can be expanded later.
+    """
+
+    CHUNK_SIZE = 65536  # flush at 64KB
+    INTERVAL = 0.05  # or every 50ms
+
+    workers = {}
+
+    def __init__(self, view, lines, threshold=None, on_done=None, append=False, expanded=()):
+        super(GitDiffStream, self).__init__(view)
+        self.lines = lines
+        self.threshold = threshold
+        self.expanded = expanded
+        self.on_done = on_done
+        self.append = append
+        self.written = False
+
+    def run(self):
+        batch, size, flushed_at = [], 0, time.time()
+        try:
+            for text in self.collapse(self.lines):
+                if not self.is_current():
+                    logger.debug('Abandoning stale diff stream for view %s', self.view_id)
+                    return
+                batch.append(text)
+                size += len(text)
+                if size >= self.CHUNK_SIZE or time.time() - flushed_at >= self.INTERVAL:
+                    self.write("".join(batch))
+                    batch, size, flushed_at = [], 0, time.time()
+            if batch:
+                self.write("".join(batch))
+            self.dispatch(self.finish)
+        except SublimeGitException as e:
+            logger.warning('Error while streaming diff: %s', e)
+            self.dispatch(sublime.error_message, e.args[0])
+            self.dispatch(self.discard)
+        finally:
+            self.lines.close()
+
+    def write(self, content):
+        replace = not self.written and not self.append
+        self.written = True
+        self.dispatch(self.view.run_command, 'git_diff_write', {'content': content, 'replace': replace})
+
+    def finish(self):
+        self.discard()
+        if callable(self.on_done):
+            self.on_done(self.written)
+
+    def collapse(self, lines):
+        if not self.threshold:
+            for line in lines:
+                yield line
+            return
+
+        header, hunks, path = [], [], None
+        size, count, collapsed = 0, 0, False
+        for line in lines:
+            if line.startswith(GIT_DIFF_FILE_HEADERS):
+                if header:
+                    yield self.render_file(header, hunks, path, size, count, collapsed)
+                header, hunks, path = [line], [], None
+                size, count, collapsed = 0, 0, False
+            elif not hunks and not collapsed and not line.startswith('@@'):
+                header.append(line)
+                if line.startswith('--- a/') and path is None:
+                    path = line[6:].rstrip('\n')
+                elif line.startswith('+++ b/'):
+                    path = line[6:].rstrip('\n')
+            else:
+                size += len(line)
+                count += 1
+                if not collapsed:
+                    hunks.append(line)
+                    if size > self.threshold and path is not None and path not in self.expanded:
+                        collapsed, hunks = True, []
+        if header:
+            yield self.render_file(header, hunks, path, size, count, collapsed)
+
+    def render_file(self, header, hunks, path, size, count, collapsed):
+        if collapsed:
+            return "".join(header) + GIT_DIFF_COLLAPSED.format(lines=count, size=size, path=path)
+        return "".join(header + hunks)
+
+
+class GitDiffWordHighlighter(GitDiffWorker):
+    """
+    Finds the hunks in the text of a diff view, and the changed words
+    between their paired removed and added lines, and marks them with
+    regions. The hunks in the viewport come first, and are marked as
+    soon as they are done.
+
+    Results are cached by hunk contents, so hunks which have already
+    been seen are never computed again.
+    """
+
+    MAX_LINE_LENGTH = 500
+    MIN_RATIO = 0.5  # don't highlight lines which have mostly changed
+    CACHE_SIZE = 10000
+
+    workers = {}
+    cache = {}
+
+    def __init__(self, view, text, visible):
+        super(GitDiffWordHighlighter, self).__init__(view)
+        self.text = text
+        self.visible = visible
+        self.size = view.size()
+
+    def get_hunks(self):
+        hunks, begin, offset = [], None, 0
+        for line in self.text.split('\n'):
+            if line.startswith('@@'):
+                if begin is not None:
+                    hunks.append((begin, offset - 1))
+                begin = offset
+            elif begin is not None and line[:1] not in (' ', '+', '-', '\\'):
+                hunks.append((begin, offset - 1))
+                begin = None
+            offset += len(line) + 1
+        if begin is not None:
+            hunks.append((begin, len(self.text)))
+        return hunks
+
+    def run(self):
+        start, end = self.visible
+        hunks = self.get_hunks()
+        first = [(a, b) for a, b in hunks if a < end and b > start]
+        rest = [(a, b) for a, b in hunks if not (a < end and b > start)]
+
+        added, removed = [], []
+        for idx, (begin, end) in enumerate(first + rest):
+            if not self.is_current():
+                return
+            if idx == len(first):
+                self.dispatch(self.apply, list(added), list(removed))
+            hunk_added, hunk_removed = self.get_word_changes(self.text[begin:end])
+            added.extend((begin + a, begin + b) for a, b in hunk_added)
+            removed.extend((begin + a, begin + b) for a, b in hunk_removed)
+        self.dispatch(self.apply, added, removed)
+        self.dispatch(self.discard)
+
+    def apply(self, added, removed):
+        if self.view.size() != self.size:
+            return
+        self.view.add_regions('git-diff.words.added', [sublime.Region(a, b) for a, b in added], 'markup.inserted.git-diff')
+        self.view.add_regions('git-diff.words.removed', [sublime.Region(a, b) for a, b in removed], 'markup.deleted.git-diff')
+
+    def get_word_changes(self, text):
+        key = (len(text), hash(text))
+        if key in GitDiffWordHighlighter.cache:
+            return GitDiffWordHighlighter.cache[key]
+
+        added, removed = [], []
+        minus, plus = [], []
+        offset = 0
+        for line in text.split('\n'):
+            if line.startswith('-'):
+                if plus:
+                    self.diff_lines(minus, plus, added, removed)
+                    minus, plus = [], []
+                minus.append((offset, line))
+            elif line.startswith('+') and minus:
+                plus.append((offset, line))
+            else:
+                self.diff_lines(minus, plus, added, removed)
+                minus, plus = [], []
+            offset += len(line) + 1
+        self.diff_lines(minus, plus, added, removed)
+
+        if len(GitDiffWordHighlighter.cache) >= self.CACHE_SIZE:
+            GitDiffWordHighlighter.cache.clear()
+        GitDiffWordHighlighter.cache[key] = (added, removed)
+        return added, removed
+
+    def diff_lines(self, minus, plus, added, removed):
+        # only pair up lines when it's obvious which lines belong together
+        if not minus or len(minus) != len(plus):
+            return
+
+        for (moffset, mline), (poffset, pline) in zip(minus, plus):
+            if len(mline) > self.MAX_LINE_LENGTH or len(pline) > self.MAX_LINE_LENGTH:
+                continue
+
+            a, b = RE_DIFF_TOKEN.findall(mline[1:]), RE_DIFF_TOKEN.findall(pline[1:])
+            matcher = difflib.SequenceMatcher(None, a, b)
+            if matcher.ratio() < self.MIN_RATIO:
+                continue
+
+            astart, bstart = self.token_offsets(a, moffset + 1), self.token_offsets(b, poffset + 1)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag in ('replace', 'delete'):
+                    removed.append((astart[i1], astart[i2]))
+                if tag in ('replace', 'insert'):
+                    added.append((bstart[j1], bstart[j2]))
+
+    def token_offsets(self, tokens, offset):
+        offsets = [offset]
+        for t in tokens:
+            offset += len(t)
+            offsets.append(offset)
+        return offsets
+
+
+class GitDiffWriteCommand(TextCommand):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit, content='', replace=False):
+        self.view.set_read_only(False)
+        if replace:
+            self.view.replace(edit, sublime.Region(0, self.view.size()), content)
+        else:
+            self.view.insert(edit, self.view.size(), content)
+        self.view.set_read_only(True)
+
+
 class GitDiffRefreshCommand(TextCommand, GitDiffTextCmd):
 
     def is_visible(self):
         return False
 
-    def run(self, edit, path=None, cached=False, run_move=False):
+    PREFETCH_CONTEXT = 10  # context to fetch when the hunk size is being adjusted
+    CONTEXT_CACHE_SIZE = 4194304  # max number of characters to keep for reuse
+
+    def run(self, edit, path=None, cached=False, run_move=False, skip_unchanged=False, reuse_context=False):
         path = path if path else self.view.settings().get('git_diff_path')
         cached = cached if cached else self.view.settings().get('git_diff_cached')
         unified = self.view.settings().get('git_diff_unified', 3)
@@ -232,19 +578,110 @@ class GitDiffRefreshCommand(TextCommand, GitDiffTextCmd):
         if path is None or cached is None:
             return
 
+        if skip_unchanged and self.is_unchanged(repo, path, cached, unified):
+            return
+
         point = self.view.sel()[0].begin() if self.view.sel() else 0
         row, col = self.view.rowcol(point)
 
-        diff = self.get_diff(repo, path, cached, unified=unified)
-        clean = False
-        if not diff:
+        capture = None
+        context_cache = self.get_context_cache(repo, path, cached, unified) if reuse_context else None
+        if context_cache:
+            # derive the diff from the last one instead of asking git again
+            context, cached_lines = context_cache
+            lines = (l for l in cached_lines)
+            logger.info('Reusing diff with context %s for view %s', context, self.view.id())
+        else:
+            context = max(unified, self.PREFETCH_CONTEXT) if reuse_context else unified
+            capture = {'context': context, 'lines': None}
+            GitDiffCache.contexts.pop(self.view.id(), None)
+            lines = self.record_diff(self.stream_diff(repo, path, cached, unified=context), capture)
+
+        if context > unified:
+            lines = self.trim_diff_context(lines, unified)
+
+        # files which have been expanded stay that way
+        expanded = set(self.view.settings().get('git_diff_expanded', []))
+
+        # large diffs of whole directories start out with a line per file
+        limit = get_setting('git_diff_summary_threshold', 200)
+        if capture and limit and os.path.isdir(os.path.join(repo, path)):
+            numstat = self.stream_diff_numstat(repo, path, cached)
+            expand = partial(self.worker().stream_diff, repo, cached=cached, unified=unified)
+            lines = self.summarize_diff(numstat, lines, limit, expanded, expand)
+
+        threshold = get_setting('git_diff_collapse_threshold', 524288)
+        on_done = partial(self.on_done, repo, path, cached, unified, capture, run_move, row, col)
+        stream = GitDiffStream(self.view, lines, threshold, on_done, expanded=expanded)
+        stream.start()
+
+    def get_context_cache(self, repo, path, cached, unified):
+        previous = GitDiffCache.fingerprints.get(self.view.id())
+        context_cache = GitDiffCache.contexts.get(self.view.id())
+        if previous is None or context_cache is None or context_cache[0] < unified:
+            return None
+        if previous[1] == self.get_fingerprint(repo, path, cached):
+            return context_cache
+
+    def record_diff(self, lines, capture):
+        recorded, size = [], 0
+        try:
+            for line in lines:
+                if recorded is not None:
+                    size += len(line)
+                    if size > self.CONTEXT_CACHE_SIZE:
+                        recorded = None
+                    else:
+                        recorded.append(line)
+                yield line
+            capture['lines'] = recorded
+        finally:
+            lines.close()
+
+    def is_unchanged(self, repo, path, cached, unified):
+        previous = GitDiffCache.fingerprints.get(self.view.id())
+        if previous is not None and previous == (unified, self.get_fingerprint(repo, path, cached)):
+            GitDiffCache.hits += 1
+            logger.info('Diff unchanged, skipping refresh of view %s (hits=%s, misses=%s)',
+                        self.view.id(), GitDiffCache.hits, GitDiffCache.misses)
+            return True
+
+        GitDiffCache.misses += 1
+        logger.info('Diff changed, refreshing view %s (hits=%s, misses=%s)',
+                    self.view.id(), GitDiffCache.hits, GitDiffCache.misses)
+        return False
+
+    def summarize_diff(self, numstat, lines, limit, expanded, expand):
+        try:
+            files = self.parse_diff_numstat("".join(numstat))
+            if len(files) <= limit:
+                for line in lines:
+                    yield line
+                return
+
+            for added, deleted, filename in files:
+                if filename in expanded:
+                    for line in expand(filename):
+                        yield line
+                    continue
+                stat = 'binary' if added == '-' else '+%s -%s' % (added, deleted)
+                yield u"diff --git a/{0} b/{0}\n".format(filename)
+                yield GIT_DIFF_SUMMARY.format(stat=stat, path=filename)
+        finally:
+            numstat.close()
+            lines.close()
+
+    def on_done(self, repo, path, cached, unified, capture, run_move, row, col, written):
+        clean = not written
+        if clean:
             diff = GIT_DIFF_CLEAN_CACHED if cached else GIT_DIFF_CLEAN
-            clean = True
+            self.view.run_command('git_diff_write', {'content': diff, 'replace': True})
 
         self.view.settings().set('git_diff_clean', clean)
-        self.view.set_read_only(False)
-        self.view.replace(edit, sublime.Region(0, self.view.size()), diff)
-        self.view.set_read_only(True)
+        GitDiffCache.fingerprints[self.view.id()] = (unified, self.get_fingerprint(repo, path, cached))
+        if capture and capture['lines'] is not None:
+            GitDiffCache.contexts[self.view.id()] = (capture['context'], capture['lines'])
+        self.view.run_command('git_diff_highlight_words')
 
         if run_move:
             self.view.run_command('git_diff_move')
@@ -259,7 +696,11 @@ class GitDiffEventListener(EventListener):
 
     def on_activated(self, view):
         if view.settings().get('git_view') in ('diff', 'diff-cached') and get_setting('git_update_diff_on_focus', True):
-            view.run_command('git_diff_refresh')
+            view.run_command('git_diff_refresh', {'skip_unchanged': True})
+
+    def on_close(self, view):
+        GitDiffCache.fingerprints.pop(view.id(), None)
+        GitDiffCache.contexts.pop(view.id(), None)
 
 
 class GitDiffChangeHunkSizeCommand(TextCommand):
@@ -273,7 +714,7 @@ class GitDiffChangeHunkSizeCommand(TextCommand):
             self.view.settings().set('git_diff_unified', unified + 1)
         else:
             self.view.settings().set('git_diff_unified', max(1, unified - 1))
-        self.view.run_command('git_diff_refresh')
+        self.view.run_command('git_diff_refresh', {'reuse_context': True})
 
 
 class GitDiffMoveCommand(TextCommand, GitDiffTextCmd):
@@ -303,14 +744,15 @@ class GitDiffMoveCommand(TextCommand, GitDiffTextCmd):
 
         file_lookup = self.parse_diff()
         hunk_lookup = self.build_lookup(file_lookup)
-        if not hunk_lookup:
+        lookup = hunk_lookup if item == 'hunk' else file_lookup
+        if not lookup:
             return
 
         goto = None
         if which == 'first':
-            goto, _ = hunk_lookup[0]
+            goto, _ = lookup[0]
         elif which == 'last':
-            goto, _ = hunk_lookup[-1]
+            goto, _ = lookup[-1]
         elif which == 'next':
             if item == 'hunk':
                 next_hunks = [(h, f) for h, f in hunk_lookup if h.begin() > start]
@@ -323,7 +765,7 @@ class GitDiffMoveCommand(TextCommand, GitDiffTextCmd):
                 prev_hunks = [(h, f) for h, f in hunk_lookup if h.end() < start]
                 goto, _ = prev_hunks[-1] if prev_hunks else hunk_lookup[0]
             else:
-                prev_files = [(f, h) for f, h in file_lookup if h[-1].end() < start]
+                prev_files = [(f, h) for f, h in file_lookup if (h[-1] if h else f).end() < start]
                 goto, _ = prev_files[-1] if prev_files else file_lookup[0]
         else:
             if item == 'hunk':
@@ -363,3 +805,52 @@ class GitDiffStageUnstageHunkCommand(GitDiffTextCmd, GitErrorHelper, TextCommand
             if exit != 0:
                 sublime.error_message(self.format_error_message(stderr))
             self.view.run_command('git_diff_refresh')
+
+
+class GitDiffExpandFileCommand(GitDiffTextCmd, TextCommand):
+
+    def is_visible(self):
+        return False
+
+    def is_enabled(self):
+        # show views include the diff syntax, but expand from the commit instead
+        return self.view.settings().get('git_view') in ('diff', 'diff-cached')
+
+    def run(self, edit):
+        repo = self.view.settings().get('git_repo')
+        cached = self.view.settings().get('git_diff_cached')
+        unified = self.view.settings().get('git_diff_unified', 3)
+
+        collapsed = self.get_collapsed_from_selection(self.view.sel())
+        if not collapsed:
+            return
+
+        # expand from the bottom, so the regions further up stay valid
+        expanded = self.view.settings().get('git_diff_expanded', [])
+        self.view.set_read_only(False)
+        for region, path in reversed(collapsed):
+            diff = self.get_diff(repo, path, cached, unified=unified)
+            if diff:
+                self.view.replace(edit, region, diff)
+                if path not in expanded:
+                    expanded.append(path)
+        self.view.set_read_only(True)
+        # remember them, so a refresh doesn't collapse them again
+        self.view.settings().set('git_diff_expanded', expanded)
+        self.view.run_command('git_diff_highlight_words')
+
+
+class GitDiffHighlightWordsCommand(GitDiffTextCmd, TextCommand):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit):
+        if not get_setting('git_diff_word_highlight', True):
+            return
+
+        # finding the hunks is left to the worker, so only copy the text here
+        visible = self.view.visible_region()
+        text = self.view.substr(sublime.Region(0, self.view.size()))
+        highlighter = GitDiffWordHighlighter(self.view, text, (visible.begin(), visible.end()))
+        highlighter.start()
@@ -29,12 +29,12 @@ class GitGitkCommand(WindowCommand, GitCmd):
 
         def async_inner():
             try:
-                os.chdir(cwd)
                 proc = subprocess.Popen(cmd,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.STDOUT,
                             startupinfo=startupinfo,
-                            env=environment)
+                            env=environment,
+                            cwd=cwd)
                 proc.wait()
             except OSError:
                 path = "\n".join(os.environ.get('PATH', '').split(':'))
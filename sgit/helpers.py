@@ -1,7 +1,11 @@
 # coding: utf-8
 import re
 import os
+import time
+import codecs
 import logging
+import threading
+from functools import partial
 import sublime
 
 from .util import get_setting
@@ -192,21 +196,168 @@ class GitRepoHelper(object):
         return GitRepoHelper.windows.get(window.id())
 
 
-class GitBranchHelper(object):
+class GitRepoStateHelper(object):
+    """
+    Cheap fingerprints of repository state, read straight from the
+    git directory so that they can be checked without running git.
+    """
+
+    def get_git_dir(self, repo):
+        git_dir = os.path.join(repo, '.git')
+        if os.path.isfile(git_dir):
+            # worktrees and submodules have a file pointing to the real git dir
+            try:
+                with open(git_dir) as f:
+                    line = f.readline().strip()
+                if line.startswith('gitdir: '):
+                    git_dir = os.path.normpath(os.path.join(repo, line[8:]))
+            except (IOError, OSError):
+                pass
+        return git_dir
+
+    def get_common_dir(self, repo):
+        git_dir = self.get_git_dir(repo)
+        try:
+            with open(os.path.join(git_dir, 'commondir')) as f:
+                return os.path.normpath(os.path.join(git_dir, f.readline().strip()))
+        except (IOError, OSError):
+            return git_dir
+
+    def get_stat_fingerprint(self, path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def get_index_fingerprint(self, repo):
+        return self.get_stat_fingerprint(os.path.join(self.get_git_dir(repo), 'index'))
+
+    def get_head_fingerprint(self, repo):
+        git_dir = self.get_git_dir(repo)
+        common_dir = self.get_common_dir(repo)
+        try:
+            with open(os.path.join(git_dir, 'HEAD')) as f:
+                head = f.readline().strip()
+        except (IOError, OSError):
+            return None
+
+        if not head.startswith('ref: '):
+            return (head, None)
+
+        # symbolic ref, find the sha for the branch
+        try:
+            with open(os.path.join(common_dir, head[5:])) as f:
+                return (head, f.readline().strip())
+        except (IOError, OSError):
+            return (head, self.get_stat_fingerprint(os.path.join(common_dir, 'packed-refs')))
+
+
+class GitIndexRefreshCache(object):
+    # last refresh, indexed by repo: (index fingerprint, saves, time)
+    refreshed = {}
+    # number of saves since startup, since saved files change the working tree
+    saves = 0
+
+
+class GitIndexRefreshHelper(GitRepoStateHelper):
+    """
+    Runs ``update-index --refresh`` only when the stat info in the index
+    may have gone stale: when the index was written since the last
+    refresh, a file was saved, or the last refresh is more than
+    INDEX_REFRESH_MAX_AGE seconds old, to pick up changes made outside
+    of Sublime Text.
+
+    Skipping a refresh can only make files look changed when they are
+    not, never the other way around.
+    """
+
+    INDEX_REFRESH_MAX_AGE = 60
+
+    def refresh_index(self, repo, **kwargs):
+        index = self.get_index_fingerprint(repo)
+        saves = GitIndexRefreshCache.saves
+        last = GitIndexRefreshCache.refreshed.get(repo)
+        if last and last[:2] == (index, saves) and time.time() - last[2] < self.INDEX_REFRESH_MAX_AGE:
+            return
+
+        # update-index exits with 1 when files have changed, anything else means it didn't run
+        if self.git_exit_code(['update-index', '--refresh'], cwd=repo, **kwargs) in (0, 1):
+            GitIndexRefreshCache.refreshed[repo] = (self.get_index_fingerprint(repo), saves, time.time())
+
+
+class GitRefCache(object):
+    # refs from git for-each-ref, indexed by repo: (fingerprint, refs)
+    catalogs = {}
+    max_keys = 10
+
+
+class GitRefHelper(GitRepoStateHelper):
+    """
+    A catalog of all refs in a repository, read with a single call to
+    git for-each-ref. It is kept until HEAD, packed-refs or anything
+    under refs/ changes on disk.
+    """
+
+    GIT_REF_FORMAT = ('%(refname)%00'
+                      '%(symref)%00'
+                      '%(committerdate:raw)%00'
+                      '%(contents:subject)')
+
+    def get_refs_fingerprint(self, repo):
+        common_dir = self.get_common_dir(repo)
+        fingerprint = [self.get_head_fingerprint(repo),
+                       self.get_stat_fingerprint(os.path.join(common_dir, 'packed-refs'))]
+        # loose refs are replaced by renaming, which touches the directory they are in
+        for root, _, _ in os.walk(os.path.join(common_dir, 'refs')):
+            fingerprint.append((root, self.get_stat_fingerprint(root)))
+        return fingerprint
+
+    def get_ref_catalog(self, repo):
+        fingerprint = self.get_refs_fingerprint(repo)
+        cached = GitRefCache.catalogs.get(repo)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        refs = []
+        for line in self.git_lines(['for-each-ref', '--format=%s' % self.GIT_REF_FORMAT], cwd=repo):
+            parts = line.split('\x00')
+            if len(parts) == 4:
+                refname, symref, date, subject = parts
+                refs.append((refname, symref, int(date.split(' ')[0]) if date else 0, subject))
+
+        if len(GitRefCache.catalogs) >= GitRefCache.max_keys:
+            GitRefCache.catalogs.clear()
+        GitRefCache.catalogs[repo] = (fingerprint, refs)
+        return refs
+
+    def warm_ref_catalog(self, repo):
+        thread = threading.Thread(target=partial(self.worker().get_ref_catalog, repo))
+        thread.daemon = True
+        thread.start()
+
+    def get_head_ref(self, repo):
+        head = self.get_head_fingerprint(repo)
+        if head and head[0].startswith('ref: '):
+            return head[0][5:]
+
+
+class GitBranchHelper(GitRefHelper):
 
     def get_current_branch(self, repo):
         branch = self.git_string(['symbolic-ref', '-q', 'HEAD'], cwd=repo)
         return branch[11:] if branch.startswith('refs/heads/') else branch
 
     def get_branches(self, repo, remotes=False):
-        lines = self.git_lines(['branch', '--list', '--no-color', '--remotes' if remotes else None], cwd=repo)
+        prefix = 'refs/remotes/' if remotes else 'refs/heads/'
+        head = self.get_head_ref(repo)
 
         branches = []
-        for line in lines:
-            current = line.startswith('*')
-            nameparts = line[2:].split(' -> ')
-            name = nameparts[1] if len(nameparts) == 2 else nameparts[0]
-            branches.append((current, name))
+        for refname, symref, _, _ in self.get_ref_catalog(repo):
+            if refname.startswith(prefix):
+                # symbolic refs like origin/HEAD are listed as the branch they point to
+                name = symref if symref.startswith(prefix) else refname
+                branches.append((refname == head, name[len(prefix):]))
 
         return branches
 
@@ -221,7 +372,7 @@ class GitRemoteHelper(GitBranchHelper):
         for r in remotes:
             name, right = r.split('\t', 1)
             url, action = right.rsplit(' ', 1)
-            names.append(name)
+            names.add(name)
         return sorted(list(names))
 
     def format_quick_remotes(self, remotes):
@@ -247,9 +398,21 @@ class GitRemoteHelper(GitBranchHelper):
     def get_branch_merge(self, repo, branch):
         return self.git_string(['config', 'branch.%s.merge' % branch], cwd=repo)
 
-    def get_remote_branches(self, repo, remote):
-        branches = [b for _, b in self.get_branches(repo, remotes=True)]
-        return [b for b in branches if b.startswith(remote + '/')]
+    def get_remote_branches(self, repo, remote, limit=None):
+        # only ask for the branches of this remote, most recently updated first,
+        # with room for the symbolic HEAD ref which is left out
+        lines = self.git_lines(['for-each-ref', '--sort=-committerdate', '--format=%(refname)%00%(symref)',
+                                '--count=%s' % (limit + 1) if limit else None, 'refs/remotes/%s' % remote], cwd=repo)
+
+        branches = []
+        for line in lines:
+            refname, _, symref = line.partition('\x00')
+            if not symref:
+                branches.append(refname[13:])
+        return branches[:limit] if limit else branches
+
+    def get_remote_branch_limit(self):
+        return get_setting('git_remote_branch_limit', 100) or None
 
     def format_quick_branches(self, branches):
         choices = []
@@ -324,9 +487,10 @@ class GitStatusHelper(object):
             idx += 1
         return lines
 
-    def get_files_status(self, repo):
+    def get_files_status(self, repo, status=None):
         untracked, unstaged, staged = [], [], []
-        status = self.get_porcelain_status(repo)
+        if status is None:
+            status = self.get_porcelain_status(repo)
         for l in status:
             state, filename = l[:2], l[3:]
             index, worktree = state
@@ -345,19 +509,83 @@ class GitStatusHelper(object):
 
     def get_untracked_mode(self):
         # get untracked files mode
-        setting = get_setting('git_status_untracked_files', 'all')
+        setting = self.setting('git_status_untracked_files', 'all')
 
         mode = 'all'
         if setting == 'none':
             mode = 'no'
+        elif setting == 'collapsed':
+            mode = 'normal'
         elif setting == 'auto':
             mode = None
         return mode
 
 
+class GitStatusCache(object):
+    # porcelain status, indexed by repo: (fingerprint, time, lines)
+    snapshots = {}
+    # contents of expanded untracked directories, indexed by (repo, directory): (fingerprint, children)
+    children = {}
+    max_children = 100
+
+
+class GitStatusSnapshotHelper(GitStatusHelper, GitIndexRefreshHelper):
+    """
+    Keeps the last porcelain status of each repository, so that quick
+    panels can be shown without running git status every time.
+
+    A snapshot is used as long as the index, HEAD and the untracked
+    files mode are unchanged, no file has been saved
+    and it is less than STATUS_SNAPSHOT_MAX_AGE seconds old.
+    """
+
+    STATUS_SNAPSHOT_MAX_AGE = 30
+
+    def get_status_fingerprint(self, repo):
+        return (self.get_index_fingerprint(repo), self.get_head_fingerprint(repo),
+                GitIndexRefreshCache.saves, self.get_untracked_mode())
+
+    def get_status_snapshot(self, repo, refresh=False):
+        snapshot = GitStatusCache.snapshots.get(repo)
+        if not refresh and snapshot and time.time() - snapshot[1] < self.STATUS_SNAPSHOT_MAX_AGE:
+            if snapshot[0] == self.get_status_fingerprint(repo):
+                return list(snapshot[2])
+
+        lines = self.get_porcelain_status(repo)
+        # git status may have refreshed the index, so fingerprint it afterwards
+        GitStatusCache.snapshots[repo] = (self.get_status_fingerprint(repo), time.time(), lines)
+        return list(lines)
+
+    def drop_status_snapshot(self, repo):
+        GitStatusCache.snapshots.pop(repo, None)
+
+    def stage_in_status_snapshot(self, repo, filename):
+        """Update the snapshot after adding a file, instead of asking git again."""
+        snapshot = GitStatusCache.snapshots.pop(repo, None)
+        if not snapshot:
+            return
+
+        lines = []
+        for line in snapshot[2]:
+            state, name = line[:2], line[3:]
+            if name == filename:
+                index, worktree = state
+                # only unstaged changes and untracked files end up staged as they are,
+                # anything else (like AD, or an untracked directory) is left to git status
+                if name.endswith('/') or not (index == ' ' or state == '??'):
+                    return
+                line = "%s  %s" % ('A' if state == '??' else worktree, name)
+            lines.append(line)
+
+        # keep the original time, so the snapshot still expires
+        GitStatusCache.snapshots[repo] = (self.get_status_fingerprint(repo), snapshot[1], lines)
+
+
 class GitDiffHelper(object):
 
-    def get_diff(self, repo, path=None, cached=False, unified=None):
+    HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+
+    def get_diff_args(self, path=None, cached=False, unified=None, numstat=False):
         try:
             unified = int(unified)
         except:
@@ -365,44 +593,428 @@ class GitDiffHelper(object):
         args = ['diff',
                 '--cached' if cached else None,
                 '--unified=%s' % unified if unified else None]
+        if numstat:
+            args.extend(['--numstat', '-z', '--no-renames'])
         if path:
             args.extend(['--', path])
+        return args
+
+    def get_diff(self, repo, path=None, cached=False, unified=None):
+        args = self.get_diff_args(path, cached, unified)
         return self.git_string(args, cwd=repo, strip=False)
 
+    def stream_diff(self, repo, path=None, cached=False, unified=None):
+        args = self.get_diff_args(path, cached, unified)
+        return self.git_stream(args, cwd=repo)
+
+    def stream_diff_numstat(self, repo, path=None, cached=False):
+        args = self.get_diff_args(path, cached, numstat=True)
+        return self.git_stream(args, cwd=repo)
+
+    def trim_diff_context(self, lines, context):
+        hunk = None
+        try:
+            for line in lines:
+                if hunk is not None:
+                    if line[:1] in (' ', '-', '+', '\\'):
+                        hunk.append(line)
+                        continue
+                    for l in self.trim_hunk_context(hunk, context):
+                        yield l
+                    hunk = None
+
+                if self.HUNK_HEADER_RE.match(line.rstrip('\r\n')):
+                    hunk = [line]
+                else:
+                    yield line
+
+            if hunk is not None:
+                for l in self.trim_hunk_context(hunk, context):
+                    yield l
+        finally:
+            lines.close()
+
+    def trim_hunk_context(self, hunk, context):
+        match = self.HUNK_HEADER_RE.match(hunk[0].rstrip('\r\n'))
+        old, old_count, new, new_count, heading = match.groups()
+        body = hunk[1:]
+
+        changes = [i for i, l in enumerate(body) if l[0] in ('-', '+')]
+        if not changes:
+            return hunk
+
+        # line numbers before each line, empty sides start before the first line
+        old = int(old) + (1 if old_count == '0' else 0)
+        new = int(new) + (1 if new_count == '0' else 0)
+        olds, news = [], []
+        for l in body:
+            olds.append(old)
+            news.append(new)
+            if l[0] in (' ', '-'):
+                old += 1
+            if l[0] in (' ', '+'):
+                new += 1
+
+        # changes closer than twice the context end up in the same hunk
+        groups = []
+        start = prev = changes[0]
+        for i in changes[1:]:
+            if i - prev - 1 > 2 * context:
+                groups.append((start, prev))
+                start = i
+            prev = i
+        groups.append((start, prev))
+
+        trimmed = []
+        for idx, (start, end) in enumerate(groups):
+            lo = max(0, start - context)
+            hi = min(len(body) - 1, end + context)
+            if hi + 1 < len(body) and body[hi + 1][0] == '\\':
+                hi += 1
+
+            lines = body[lo:hi + 1]
+            old_lines = len([l for l in lines if l[0] in (' ', '-')])
+            new_lines = len([l for l in lines if l[0] in (' ', '+')])
+            old_start = olds[lo] if old_lines else olds[lo] - 1
+            new_start = news[lo] if new_lines else news[lo] - 1
+
+            trimmed.append('@@ -%s +%s @@%s\n' % (self.format_hunk_range(old_start, old_lines),
+                                                 self.format_hunk_range(new_start, new_lines),
+                                                 heading if idx == 0 else ''))
+            trimmed.extend(lines)
+        return trimmed
+
+    def format_hunk_range(self, start, count):
+        if count == 1:
+            return '%s' % start
+        return '%s,%s' % (start, count)
+
+    def parse_diff_numstat(self, output):
+        files = []
+        for record in output.split('\x00'):
+            parts = record.split('\t', 2)
+            if len(parts) == 3:
+                files.append(tuple(parts))
+        return files
+
+
+class GitShowCache(object):
+    # show output for full commit shas, indexed by (sha, part): (last use, content)
+    entries = {}
+    size = 0
+    tick = 0
+    max_size = 33554432  # characters kept in memory
+    max_entry_size = 4194304  # larger output is never cached
+    max_disk_entries = 1000
+    # show output is loaded by several threads at once
+    lock = threading.Lock()
+
 
 class GitShowHelper(object):
 
+    SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
     def get_show(self, repo, obj):
         return self.git_string(['show', '--format=medium', '--no-color', obj], cwd=repo)
 
+    def get_show_stat(self, repo, obj, cache=False):
+        stat = self.get_cached_show(obj, 'stat') if cache else None
+        if stat is None:
+            stat = self.git_string(['show', '--format=medium', '--stat', '--no-color', obj], cwd=repo, strip=False)
+            if cache and stat:
+                self.set_cached_show(obj, 'stat', stat)
+        return stat
+
+    def get_show_patch(self, repo, obj, path):
+        return self.git_string(['show', '--format=', '--no-color', obj, '--', path], cwd=repo, strip=False)
+
+    def stream_show_patch(self, repo, obj, cache=False):
+        patch = self.get_cached_show(obj, 'patch') if cache else None
+        if patch is not None:
+            return (line for line in patch.splitlines(True))
+        lines = self.git_stream(['show', '--format=', '--no-color', obj], cwd=repo)
+        return self.record_show(lines, obj, 'patch') if cache else lines
+
+    def record_show(self, lines, sha, part):
+        recorded, size = [], 0
+        try:
+            for line in lines:
+                if recorded is not None:
+                    size += len(line)
+                    if size > GitShowCache.max_entry_size:
+                        recorded = None
+                    else:
+                        recorded.append(line)
+                yield line
+            if recorded is not None:
+                self.set_cached_show(sha, part, u''.join(recorded))
+        finally:
+            lines.close()
+
+    def get_cached_show(self, sha, part):
+        if not self.SHA_RE.match(sha):
+            return None
+
+        key = (sha, part)
+        with GitShowCache.lock:
+            GitShowCache.tick += 1
+            entry = GitShowCache.entries.get(key)
+            if entry is not None:
+                GitShowCache.entries[key] = (GitShowCache.tick, entry[1])
+                return entry[1]
+
+        content = self.read_disk_cache(sha, part)
+        if content is not None:
+            self.set_cached_show(sha, part, content, disk=False)
+        return content
+
+    def set_cached_show(self, sha, part, content, disk=True):
+        if not self.SHA_RE.match(sha) or len(content) > GitShowCache.max_entry_size:
+            return
 
-class GitLogHelper(object):
-
-    GIT_QUICK_LOG_FORMAT = ('%s%x03'   # subject
-                            '%H%x03'   # sha1
-                            '%an%x03'  # author name
-                            '%aE%x03'  # author email
-                            '%ad%x03'  # auth date
-                            '%ar'    # auth date relative
-                            '%x04')
+        key = (sha, part)
+        with GitShowCache.lock:
+            GitShowCache.tick += 1
+            previous = GitShowCache.entries.get(key)
+            if previous is not None:
+                GitShowCache.size -= len(previous[1])
+            GitShowCache.entries[key] = (GitShowCache.tick, content)
+            GitShowCache.size += len(content)
+
+            # drop the least recently used entries
+            if GitShowCache.size > GitShowCache.max_size:
+                for _, k in sorted((e[0], k) for k, e in GitShowCache.entries.items()):
+                    if GitShowCache.size <= GitShowCache.max_size:
+                        break
+                    GitShowCache.size -= len(GitShowCache.entries.pop(k)[1])
+
+        if disk:
+            self.write_disk_cache(sha, part, content)
+
+    def get_disk_cache_dir(self):
+        # cache_path is only there in Sublime Text 3, where the API works from any thread
+        if not self.setting('git_show_disk_cache', False) or not hasattr(sublime, 'cache_path'):
+            return None
+        return os.path.join(sublime.cache_path(), 'SublimeGit', 'show')
+
+    def read_disk_cache(self, sha, part):
+        cache_dir = self.get_disk_cache_dir()
+        if not cache_dir:
+            return None
+        try:
+            with codecs.open(os.path.join(cache_dir, '%s.%s' % (sha, part)), 'r', 'utf-8') as f:
+                return f.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return None
+
+    def write_disk_cache(self, sha, part, content):
+        cache_dir = self.get_disk_cache_dir()
+        if not cache_dir:
+            return
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with codecs.open(os.path.join(cache_dir, '%s.%s' % (sha, part)), 'w', 'utf-8') as f:
+                f.write(content)
+
+            # remove the oldest files when there are too many
+            names = os.listdir(cache_dir)
+            if len(names) > GitShowCache.max_disk_entries:
+                paths = sorted((os.path.getmtime(p), p) for p in (os.path.join(cache_dir, n) for n in names))
+                for _, path in paths[:len(names) - GitShowCache.max_disk_entries]:
+                    os.remove(path)
+        except (IOError, OSError) as e:
+            logger.warning('Could not write show cache: %s', e)
+
+
+class GitCommitStore(object):
+    # immutable commit metadata, indexed by sha: (subject, author name, author email, author time)
+    commits = {}
+    max_size = 100000
+
+
+class GitFollowCache(object):
+    # file histories from git log --follow, indexed by (repo, path): (head sha, shas)
+    histories = {}
+    max_keys = 50
+
+
+class GitCommitInfoHelper(object):
+
+    GIT_COMMIT_INFO_FORMAT = ('%H%x03'   # sha1
+                              '%s%x03'   # subject
+                              '%an%x03'  # author name
+                              '%aE%x03'  # author email
+                              '%at'      # author time
+                              '%x04')
+
+    def add_commit_info(self, sha, subject, name, email, timestamp):
+        if len(GitCommitStore.commits) >= GitCommitStore.max_size:
+            GitCommitStore.commits.clear()
+        info = (subject, name, email, int(timestamp))
+        GitCommitStore.commits[sha] = info
+        return info
+
+    def get_commit_info(self, repo, shas):
+        commits = {}
+        missing = []
+        for sha in shas:
+            if sha in GitCommitStore.commits:
+                commits[sha] = GitCommitStore.commits[sha]
+            else:
+                missing.append(sha)
+
+        if missing:
+            cmd = ['log', '--no-walk=unsorted', '--stdin', '--no-color', '--format=%s' % self.GIT_COMMIT_INFO_FORMAT]
+            lines = self.git_stream(cmd, cwd=repo, stdin="\n".join(missing))
+            for parts in self.read_log_records(lines, 5):
+                commits[parts[0]] = self.add_commit_info(*parts)
+        return commits
+
+    def read_log_records(self, lines, fields):
+        # records are terminated by \x04 and may span several lines
+        pending = []
+        try:
+            for line in lines:
+                while u'\u0004' in line:
+                    head, line = line.split(u'\u0004', 1)
+                    pending.append(head)
+                    record = u''.join(pending).strip()
+                    pending = []
+                    if record:
+                        parts = record.split(u'\u0003')
+                        if len(parts) != fields:
+                            raise Exception("The record %s splits to %s" % (record, parts))
+                        yield parts
+                pending.append(line)
+        finally:
+            lines.close()
+
+    def format_commit_date(self, timestamp):
+        return time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(timestamp))
+
+    def format_relative_date(self, timestamp):
+        def plural(n, unit):
+            return '%s %s%s' % (n, unit, '' if n == 1 else 's')
+
+        diff = int(time.time() - timestamp)
+        if diff < 0:
+            return 'in the future'
+        if diff < 90:
+            return '%s ago' % plural(diff, 'second')
+        diff = (diff + 30) // 60
+        if diff < 90:
+            return '%s ago' % plural(diff, 'minute')
+        diff = (diff + 30) // 60
+        if diff < 36:
+            return '%s ago' % plural(diff, 'hour')
+        diff = (diff + 12) // 24
+        if diff < 14:
+            return '%s ago' % plural(diff, 'day')
+        if diff < 70:
+            return '%s ago' % plural((diff + 3) // 7, 'week')
+        if diff < 365:
+            return '%s ago' % plural((diff + 15) // 30, 'month')
+        if diff < 1825:
+            total_months = (diff * 12 * 2 + 365) // (365 * 2)
+            years, months = total_months // 12, total_months % 12
+            if months:
+                return '%s, %s ago' % (plural(years, 'year'), plural(months, 'month'))
+            return '%s ago' % plural(years, 'year')
+        return '%s ago' % plural((diff + 183) // 365, 'year')
+
+
+class GitLogHelper(GitCommitInfoHelper):
+
+    GIT_LOG_BATCH_SIZE = 50
+
+    def get_quick_log(self, repo, path=None, follow=False, limit=None, skip=None):
+        lines = []
+        for batch in self.stream_quick_log(repo, path=path, follow=follow, limit=limit, skip=skip):
+            lines.extend(batch)
+        return lines
 
-    def get_quick_log(self, repo, path=None, follow=False):
-        cmd = ['log', '--no-color', '--date=local', '--format=%s' % self.GIT_QUICK_LOG_FORMAT]
+    def stream_quick_log(self, repo, path=None, follow=False, limit=None, skip=None):
+        cmd = ['log', '--no-color', '--format=%H',
+               '--max-count=%s' % limit if limit else None,
+               '--skip=%s' % skip if skip else None]
         if follow:
             cmd.append('--follow')
         if path:
             cmd.extend(['--', path])
-        out = self.git_string(cmd, cwd=repo, strip=False)
 
-        lines = []
-        for line in out.split(u'\u0004'):
-            line = line.strip()
-            if line:
-                parts = line.split(u'\u0003')
-                if len(parts) != 6:
-                    raise Exception("The line %s splits to %s", line, parts)
-                lines.append(parts)
-        return lines
+        if follow and path:
+            # file histories are computed once, so pages are just slices
+            start = skip or 0
+            page = self.get_follow_history(repo, path)[start:start + limit if limit else None]
+            for i in range(0, len(page), self.GIT_LOG_BATCH_SIZE):
+                yield self.get_quick_log_entries(repo, page[i:i + self.GIT_LOG_BATCH_SIZE])
+            return
+
+        lines = self.git_stream(cmd, cwd=repo)
+        try:
+            shas = []
+            for line in lines:
+                sha = line.strip()
+                if sha:
+                    shas.append(sha)
+                if len(shas) >= self.GIT_LOG_BATCH_SIZE:
+                    yield self.get_quick_log_entries(repo, shas)
+                    shas = []
+            if shas:
+                yield self.get_quick_log_entries(repo, shas)
+        finally:
+            lines.close()
+
+    def get_follow_history(self, repo, path):
+        key = (repo, path)
+        head = self.git_string(['rev-parse', '--verify', '-q', 'HEAD'], cwd=repo)
+        if not head:
+            return []
+
+        cached = GitFollowCache.histories.get(key)
+        if cached and cached[0] == head:
+            return cached[1]
+
+        shas = None
+        if cached and self.git_exit_code(['merge-base', '--is-ancestor', cached[0], head], cwd=repo) == 0:
+            shas = self.get_follow_history_since(repo, path, cached[0], head)
+            if shas is not None:
+                shas.extend(cached[1])
+
+        if shas is None:
+            shas = [l.strip() for l in self.git_stream(['log', '--follow', '--format=%H', '--', path], cwd=repo)]
+            shas = [sha for sha in shas if sha]
+
+        if len(GitFollowCache.histories) >= GitFollowCache.max_keys:
+            GitFollowCache.histories.clear()
+        GitFollowCache.histories[key] = (head, shas)
+        return shas
+
+    def get_follow_history_since(self, repo, path, since, head):
+        # new commits can be put in front of the old history, as long as the
+        # file was neither added nor renamed since then
+        output = self.git_lines(['log', '--follow', '--name-status', '--format=%H',
+                                 '%s..%s' % (since, head), '--', path], cwd=repo)
+        shas = []
+        for line in output:
+            if '\t' in line:
+                if line[0] in ('A', 'R', 'C'):
+                    return None
+            elif line.strip():
+                shas.append(line.strip())
+        return shas
+
+    def get_quick_log_entries(self, repo, shas):
+        commits = self.get_commit_info(repo, shas)
+
+        entries = []
+        for sha in shas:
+            if sha in commits:
+                subject, name, email, timestamp = commits[sha]
+                entries.append([subject, sha, name, email,
+                                self.format_commit_date(timestamp), self.format_relative_date(timestamp)])
+        return entries
 
     def format_quick_log(self, log):
         hashes = [l[1] for l in log]
@@ -412,13 +1024,17 @@ class GitLogHelper(object):
         return hashes, choices
 
 
-class GitTagHelper(object):
+class GitTagHelper(GitRefHelper):
 
     def get_tags(self, repo, annotate=True):
-        if annotate:
-            return self.git_lines(['tag', '--list', '-n1'], cwd=repo)
-        else:
-            return self.git_lines(['tag', '--list', '-n0', '--no-column'], cwd=repo)
+        tags = []
+        for refname, _, _, subject in self.get_ref_catalog(repo):
+            if refname.startswith('refs/tags/'):
+                if annotate:
+                    tags.append('%s %s' % (refname[10:], subject))
+                else:
+                    tags.append(refname[10:])
+        return tags
 
     def format_quick_tags(self, tags):
         out = []
@@ -1,14 +1,108 @@
 # coding: utf-8
-#import sublime
-from sublime_plugin import WindowCommand, TextCommand
+import os
+import threading
+from functools import partial
 
-from .util import noop
+import sublime
+from sublime_plugin import WindowCommand, TextCommand, EventListener
+
+from .util import noop, get_setting, find_view_by_settings, StatusSpinner
 from .cmd import GitCmd
-from .helpers import GitLogHelper
+from .helpers import GitLogHelper, GitRepoStateHelper
 
 
 GIT_LOG_FORMAT = '--format=%s%n%H by %an <%aE>%n%ar (%ad)'
 
+GIT_LOG_MORE = '+ Load more'
+GIT_LOG_MORE_DESC = 'Show the next %s commits'
+
+GIT_LOG_GRAPH_TITLE_PREFIX = '*git-log-graph*: '
+GIT_LOG_GRAPH_SYNTAX = 'Packages/SublimeGit/syntax/SublimeGit Log Graph.tmLanguage'
+GIT_LOG_GRAPH_MORE = u"+ Load more ({shown} of {total} commits shown)"
+
+
+class GitLogCache(object):
+    # loaded log entries, indexed by (repo, path, follow)
+    pages = {}
+    max_keys = 20
+
+
+class GitLogGraphCache(object):
+    # commit graphs, indexed by repo: (head fingerprint, graph)
+    graphs = {}
+    max_keys = 2
+    # render state, indexed by view id
+    views = {}
+
+
+class GitCommitGraph(object):
+    """
+    Commits in topological order, with parents stored as row numbers.
+    """
+
+    def __init__(self, shas, parents):
+        self.shas = shas
+        self.rows = dict((sha, row) for row, sha in enumerate(shas))
+        self.parents = [tuple(self.rows[p] for p in ps if p in self.rows) for ps in parents]
+
+    def __len__(self):
+        return len(self.shas)
+
+
+class GitLogWindowCmd(GitCmd, GitRepoStateHelper, GitLogHelper):
+
+    def show_quick_log(self, window, repo, on_select, path=None, follow=False):
+        key = (repo, path, follow)
+        head = self.get_head_fingerprint(repo)
+
+        cached = GitLogCache.pages.get(key)
+        if cached and cached[0] == head:
+            _, log, complete = cached
+            self.show_log_panel(window, key, head, log, complete, on_select)
+        else:
+            self.load_log_page(window, key, head, [], on_select)
+
+    def load_log_page(self, window, key, head, log, on_select):
+        repo, path, follow = key
+        page_size = get_setting('git_log_page_size', 200)
+        worker = self.worker()
+
+        def load():
+            entries = list(log)
+            for batch in worker.stream_quick_log(repo, path=path, follow=follow, limit=page_size, skip=len(log)):
+                entries.extend(batch)
+            complete = len(entries) - len(log) < page_size
+
+            if len(GitLogCache.pages) >= GitLogCache.max_keys:
+                GitLogCache.pages.clear()
+            GitLogCache.pages[key] = (head, entries, complete)
+
+            sublime.set_timeout(partial(self.show_log_panel, window, key, head, entries, complete, on_select, len(log)), 0)
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        runner = StatusSpinner(thread, "Loading log")
+        runner.start()
+
+    def show_log_panel(self, window, key, head, log, complete, on_select, selected=0):
+        hashes, choices = self.format_quick_log(log)
+        if not complete:
+            page_size = get_setting('git_log_page_size', 200)
+            choices.append([GIT_LOG_MORE, GIT_LOG_MORE_DESC % page_size, ''])
+
+        def on_done(idx):
+            if idx == -1:
+                return
+            if idx == len(hashes):
+                self.load_log_page(window, key, head, log, on_select)
+            else:
+                on_select(hashes[idx])
+
+        if sublime.version() >= '3000':
+            window.show_quick_panel(choices, on_done, 0, min(selected, len(choices) - 1))
+        else:
+            window.show_quick_panel(choices, on_done)
+
 
 class GitLogCommand(WindowCommand, GitCmd):
     """
@@ -19,7 +113,7 @@ class GitLogCommand(WindowCommand, GitCmd):
         self.window.run_command('git_quick_log')
 
 
-class GitQuickLogCommand(WindowCommand, GitCmd, GitLogHelper):
+class GitQuickLogCommand(WindowCommand, GitLogWindowCmd):
     """
     Documentation coming soon.
     """
@@ -29,39 +123,314 @@ class GitQuickLogCommand(WindowCommand, GitCmd, GitLogHelper):
         if not repo:
             return
 
-        log = self.get_quick_log(repo)
-        hashes, choices = self.format_quick_log(log)
-
-        def on_done(idx):
-            if idx == -1:
-                return
-            commit = hashes[idx]
+        def on_select(commit):
             self.window.run_command('git_show', {'obj': commit, 'repo': repo})
 
-        self.window.show_quick_panel(choices, on_done)
+        self.show_quick_log(self.window, repo, on_select)
 
 
-class GitQuickLogCurrentFileCommand(TextCommand, GitCmd, GitLogHelper):
+class GitQuickLogCurrentFileCommand(TextCommand, GitLogWindowCmd):
     """
     Documentation coming soon.
     """
 
     def run(self, edit):
+        window = self.view.window()
+
         filename = self.view.file_name()
         if not filename:
-            self.window.show_quick_panel(['No log for file'], noop)
+            window.show_quick_panel(['No log for file'], noop)
+            return
 
         repo = self.get_repo()
         if not repo:
             return
 
-        log = self.get_quick_log(repo, path=filename, follow=True)
-        hashes, choices = self.format_quick_log(log)
+        def on_select(commit):
+            window.run_command('git_show', {'obj': commit, 'repo': repo})
 
-        def on_done(idx):
-            if idx == -1:
-                return
-            commit = hashes[idx]
-            self.view.window().run_command('git_show', {'obj': commit, 'repo': repo})
+        self.show_quick_log(window, repo, on_select, path=filename, follow=True)
+
+
+class GitLogGraphCmd(GitCmd, GitLogHelper, GitRepoStateHelper):
+
+    def get_commit_graph(self, repo):
+        shas = []
+        parents = []
+        for line in self.git_stream(['rev-list', '--topo-order', '--parents', 'HEAD'], cwd=repo):
+            parts = line.split()
+            if parts:
+                shas.append(parts[0])
+                parents.append(parts[1:])
+        return GitCommitGraph(shas, parents)
+
+    def draw_commit(self, lanes, col):
+        return u' '.join(u'*' if i == col else u'|' for i in range(lanes))
+
+    def draw_edges(self, edges):
+        # lanes move sideways by at most one column per line, like git log --graph
+        lines = []
+        while True:
+            step = [(f, f + 1 if f < t else (f - 1 if f > t else f)) for f, t in edges]
+            lines.append(self.draw_step(step))
+            edges = [(n, t) for (_, n), (_, t) in zip(step, edges)]
+            if all(f == t for f, t in edges):
+                return lines
+
+    def draw_step(self, edges):
+        width = 2 * max(max(f, t) for f, t in edges) + 2
+        chars = [u' '] * width
+        for f, t in edges:
+            if f < t:
+                chars[2 * t - 1] = u'\\'
+            elif f > t:
+                chars[2 * t + 1] = u'/'
+        for f, t in edges:
+            if f == t:
+                chars[2 * t] = u'|'
+        return u''.join(chars).rstrip()
+
+    def layout_graph(self, graph, start, end, lanes):
+        """
+        Lay out rows start to end, given the lanes left open by the rows
+        above. Each lane holds the row it is waiting for. Returns the
+        graph lines with the row they belong to (or None for connecting
+        lines) and the lanes left open afterwards.
+        """
+        lanes = list(lanes)
+        lines = []
+        for row in range(start, end):
+            cols = [i for i, l in enumerate(lanes) if l == row]
+            if not cols:
+                lanes.append(row)
+                col = len(lanes) - 1
+            else:
+                col = cols[0]
+                if len(cols) > 1:
+                    # several lanes were waiting for this commit, merge them
+                    edges, remaining = [], []
+                    for i, l in enumerate(lanes):
+                        if i in cols[1:]:
+                            edges.append((i, col))
+                        else:
+                            edges.append((i, len(remaining)))
+                            remaining.append(l)
+                    lines.extend((line, None) for line in self.draw_edges(edges))
+                    lanes = remaining
+
+            lines.append((self.draw_commit(len(lanes), col), row))
+
+            # replace the commit with its parents, opening lanes for new merge parents
+            parents = graph.parents[row]
+            new = [p for p in parents[1:] if p not in lanes]
+            edges = [(i, i) for i in range(col)]
+            if parents:
+                edges.append((col, col))
+                edges.extend((col, col + 1 + i) for i in range(len(new)))
+                edges.extend((i, i + len(new)) for i in range(col + 1, len(lanes)))
+                lanes = lanes[:col] + [parents[0]] + new + lanes[col + 1:]
+            else:
+                edges.extend((i, i - 1) for i in range(col + 1, len(lanes)))
+                lanes = lanes[:col] + lanes[col + 1:]
+            for p in parents[1:]:
+                if p not in new:
+                    edges.append((col, lanes.index(p)))
+            if any(f != t for f, t in edges):
+                lines.extend((line, None) for line in self.draw_edges(edges))
+        return lines, lanes
+
+    def format_graph_page(self, repo, graph, start, end, lanes):
+        lines, lanes = self.layout_graph(graph, start, end, lanes)
+        commits = self.get_commit_info(repo, graph.shas[start:end])
+
+        content = []
+        line_rows = []
+        for text, row in lines:
+            if row is not None:
+                sha = graph.shas[row]
+                subject, name, _, timestamp = commits.get(sha, (u'', u'', u'', 0))
+                text = u'%s %s %s (%s, %s)' % (text, sha[:7], subject, name, self.format_relative_date(timestamp))
+            content.append(text)
+            line_rows.append(row)
+        return content, line_rows, lanes
+
+
+class GitLogGraphCommand(WindowCommand, GitLogGraphCmd):
+    """
+    Show the history of the current branch as a graph.
+
+    The commit graph is read once per ``HEAD`` and kept in memory,
+    while rows are only laid out and written to the view a page at
+    a time, as you move towards the end of the view. This keeps the
+    view responsive in repositories with a very long history.
+
+    Press ``enter`` on a commit to show it.
+
+    :setting git_log_graph_page_size: The number of commits to lay out
+        and show at a time in the graph view. Defaults to 500.
+
+    """
+
+    def run(self, repo=None):
+        repo = repo or self.get_repo()
+        if not repo:
+            return
+
+        view = find_view_by_settings(self.window, git_view='log-graph', git_repo=repo)
+        if view is None:
+            view = self.window.new_file()
+            view.set_name(GIT_LOG_GRAPH_TITLE_PREFIX + os.path.basename(repo))
+            view.set_scratch(True)
+            view.set_read_only(True)
+            view.set_syntax_file(GIT_LOG_GRAPH_SYNTAX)
+
+            view.settings().set('word_wrap', False)
+            view.settings().set('git_view', 'log-graph')
+            view.settings().set('git_repo', repo)
+        else:
+            self.window.focus_view(view)
+
+        view.run_command('git_log_graph_refresh')
+
+
+class GitLogGraphRefreshCommand(TextCommand, GitLogGraphCmd):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit):
+        repo = self.view.settings().get('git_repo')
+        head = self.get_head_fingerprint(repo)
+
+        cached = GitLogGraphCache.graphs.get(repo)
+        if cached and cached[0] == head:
+            self.on_graph(repo, cached[1])
+            return
+
+        worker = self.worker()
+
+        def load():
+            graph = worker.get_commit_graph(repo)
+            if len(GitLogGraphCache.graphs) >= GitLogGraphCache.max_keys:
+                GitLogGraphCache.graphs.clear()
+            GitLogGraphCache.graphs[repo] = (head, graph)
+            sublime.set_timeout(partial(self.on_graph, repo, graph), 0)
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        runner = StatusSpinner(thread, "Reading commit graph")
+        runner.start()
+
+    def on_graph(self, repo, graph):
+        GitLogGraphCache.views[self.view.id()] = {'graph': graph, 'lanes': [], 'line_rows': [],
+                                                  'next_row': 0, 'loading': False}
+        self.view.run_command('git_log_graph_load_more', {'replace': True})
+
+
+class GitLogGraphLoadMoreCommand(TextCommand, GitLogGraphCmd):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit, replace=False):
+        state = GitLogGraphCache.views.get(self.view.id())
+        if not state or state['loading'] or state['next_row'] >= len(state['graph']):
+            return
+        state['loading'] = True
+
+        repo = self.view.settings().get('git_repo')
+        graph = state['graph']
+        start = state['next_row']
+        end = min(start + get_setting('git_log_graph_page_size', 500), len(graph))
+
+        worker = self.worker()
+
+        def load():
+            try:
+                content, line_rows, lanes = worker.format_graph_page(repo, graph, start, end, state['lanes'])
+                sublime.set_timeout(partial(self.on_page, state, content, line_rows, lanes, end, replace), 0)
+            finally:
+                # runs after on_page, so the page is in place before the next one can load
+                sublime.set_timeout(partial(self.on_loaded, state), 0)
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+
+    def on_loaded(self, state):
+        state['loading'] = False
+
+    def on_page(self, state, content, line_rows, lanes, end, replace):
+        if GitLogGraphCache.views.get(self.view.id()) is not state:
+            return
+        state['lanes'] = lanes
+        state['line_rows'].extend(line_rows)
+        state['next_row'] = end
+
+        text = u'\n'.join(content)
+        if end < len(state['graph']):
+            text += u'\n' + GIT_LOG_GRAPH_MORE.format(shown=end, total=len(state['graph']))
+
+        if replace:
+            self.view.run_command('git_log_graph_write', {'content': text, 'replace': True})
+            self.view.sel().clear()
+            self.view.sel().add(sublime.Region(0))
+        else:
+            self.view.run_command('git_log_graph_write', {'content': text})
+
+
+class GitLogGraphWriteCommand(TextCommand):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit, content='', replace=False):
+        self.view.set_read_only(False)
+        if replace:
+            self.view.replace(edit, sublime.Region(0, self.view.size()), content)
+        else:
+            # replace the load more line with the next page
+            more = self.view.line(self.view.size())
+            self.view.replace(edit, more, content)
+        self.view.set_read_only(True)
+
+
+class GitLogGraphShowCommand(TextCommand, GitCmd):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit):
+        state = GitLogGraphCache.views.get(self.view.id())
+        if not state:
+            return
+
+        repo = self.view.settings().get('git_repo')
+        line_rows = state['line_rows']
+        window = self.view.window()
+
+        rows = set()
+        for s in self.view.sel():
+            for line in self.view.lines(s):
+                num, _ = self.view.rowcol(line.begin())
+                if num >= len(line_rows):
+                    self.view.run_command('git_log_graph_load_more')
+                elif line_rows[num] is not None and line_rows[num] not in rows:
+                    rows.add(line_rows[num])
+                    window.run_command('git_show', {'repo': repo, 'obj': state['graph'].shas[line_rows[num]]})
+
+
+class GitLogGraphEventListener(EventListener):
+
+    PRELOAD_LINES = 100  # load the next page when the cursor gets this close to the end
+
+    def on_selection_modified(self, view):
+        if view.settings().get('git_view') == 'log-graph':
+            state = GitLogGraphCache.views.get(view.id())
+            if state and len(view.sel()) > 0:
+                row, _ = view.rowcol(view.sel()[-1].end())
+                if row >= len(state['line_rows']) - self.PRELOAD_LINES:
+                    view.run_command('git_log_graph_load_more')
 
-        self.view.window().show_quick_panel(choices, on_done)
+    def on_close(self, view):
+        GitLogGraphCache.views.pop(view.id(), None)
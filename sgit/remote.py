@@ -1,14 +1,21 @@
 # coding: utf-8
+import re
+import time
+import random
+import logging
 from functools import partial
 
 import sublime
-from sublime_plugin import WindowCommand
+from sublime_plugin import WindowCommand, EventListener
 
-from .util import StatusSpinner, noop
-from .cmd import GitCmd
+from .util import StatusSpinner, noop, get_setting
+from .cmd import GitCmd, CommandExecutor
 from .helpers import GitRemoteHelper
 
 
+logger = logging.getLogger('SublimeGit.remote')
+
+
 NO_REMOTES = u"No remotes have been configured. Remotes can be added with the Git: Add Remote command. Do you want to add a remote now?"
 DELETE_REMOTE = u"Are you sure you want to delete the remote %s?"
 
@@ -23,6 +30,12 @@ NO_TRACKING = u"No tracking information is configured for your current branch. D
 
 REMOTE_SHOW_TITLE_PREFIX = '*git-remote*: '
 
+FETCH_REMOTE_LINE = u"{remote}  {status}"
+FETCH_SUMMARY = u"\nFetched {remotes} remotes in {time:.1f}s: {updated} refs updated, {failed} failed\n"
+
+REMOTE_BRANCHES_ALL = u'+ Show all branches'
+REMOTE_BRANCHES_ALL_DESC = u'Only the %s most recently updated branches are shown'
+
 
 class GitFetchCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -31,8 +44,25 @@ class GitFetchCommand(WindowCommand, GitCmd, GitRemoteHelper):
     If there is only one remote configured, this remove will be
     used for fetching. If there are multiple remotes, you will be
     asked to select the remote to fetch from.
+
+    Fetching from all remotes runs a single git fetch, which fetches
+    from several remotes at the same time, with a line per remote in
+    the output panel showing how it went. It can be stopped from
+    Git: Running Commands.
+
+    :setting git_fetch_jobs: The number of remotes to fetch from at the
+        same time when fetching from all remotes. Defaults to 4. Older
+        versions of git than 2.24 fetch from one remote at a time.
     """
 
+    # ref update lines from git fetch -v, e.g. "   1a2b3c..4d5e6f  master -> origin/master"
+    REF_UPDATE_RE = re.compile(r'^ ([ +\-t*!=]) .+ -> \S+')
+    # git fetch --multiple prints the output for each remote in one block, after a From line
+    FETCHING_RE = re.compile(r'^Fetching (\S+)$')
+    FETCH_FAILED_RE = re.compile(r"^(?:error: )?[Cc]ould not fetch '?([^' ]+)'?")
+    # git leaves out any user and password in the urls it prints
+    CREDENTIALS_RE = re.compile(r'//[^/@]+@')
+
     def run(self, ask_remotes=False):
         repo = self.get_repo()
         if not repo:
@@ -52,7 +82,7 @@ class GitFetchCommand(WindowCommand, GitCmd, GitRemoteHelper):
                 if idx == -1:
                     return
                 if idx == len(choices) - 1:
-                    self.on_remote(repo)
+                    self.fetch_all(repo, remotes)
                 else:
                     self.on_remote(repo, choices[idx][0])
 
@@ -64,15 +94,105 @@ class GitFetchCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.panel = self.window.get_output_panel('git-fetch')
         self.panel_shown = False
 
-        thread = self.git_async(['fetch', '-v', remote if remote else '--all'], cwd=repo, on_data=self.on_data)
-        runner = StatusSpinner(thread, "Fetching from %s" % (remote if remote else "all remotes"))
-        runner.start()
+        thread = self.git_async(['fetch', '-v', '--progress', remote if remote else '--all'], cwd=repo,
+                                on_data=self.on_data, on_progress=self.on_progress,
+                                on_complete=partial(self.on_complete, repo))
+        self.runner = StatusSpinner(thread, "Fetching from %s" % (remote if remote else "all remotes"))
+        self.runner.start()
 
     def on_data(self, d):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-fetch'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
 
+    def on_progress(self, event):
+        self.runner.update(event)
+
+    def on_complete(self, repo, exit_code):
+        # remote branches have most likely changed
+        self.warm_ref_catalog(repo)
+
+    def normalize_fetch_url(self, url):
+        # as printed on the From line, which also drops trailing slashes and .git
+        url = self.CREDENTIALS_RE.sub('//', url).rstrip('/')
+        return url[:-4] if url.endswith('.git') else url
+
+    def fetch_all(self, repo, remotes):
+        self.panel = self.window.get_output_panel('git-fetch')
+        self.window.run_command('show_panel', {'panel': 'output.git-fetch'})
+
+        names = self.get_remote_names(remotes)
+        urls = {}
+        for r in remotes:
+            name, right = r.split('\t', 1)
+            urls[self.normalize_fetch_url(right.rsplit(' ', 1)[0])] = name
+
+        width = max(len(r) for r in names)
+        lines = [FETCH_REMOTE_LINE.format(remote=r.ljust(width), status='waiting') for r in names]
+        self.panel.run_command('git_panel_append', {'content': "\n".join(lines) + "\n"})
+
+        started = time.time()
+        updated = dict((r, 0) for r in names)
+        errors = {}
+        block = {'remote': None, 'errors': []}
+
+        def set_status(remote, status):
+            content = FETCH_REMOTE_LINE.format(remote=remote.ljust(width), status=status)
+            self.panel.run_command('git_panel_set_line', {'row': names.index(remote), 'content': content})
+
+        def get_remote(ref):
+            # remote tracking branches are named after their remote
+            for name in sorted(names, key=len, reverse=True):
+                if ref.startswith(name + '/'):
+                    return name
+            return block['remote']
+
+        def on_data(text):
+            for line in text.splitlines():
+                fetching = self.FETCHING_RE.match(line)
+                failed = self.FETCH_FAILED_RE.match(line)
+                if fetching and fetching.group(1) in updated:
+                    set_status(fetching.group(1), 'fetching...')
+                elif line.startswith('From '):
+                    block['remote'], block['errors'] = urls.get(self.normalize_fetch_url(line[5:].strip())), []
+                elif failed and failed.group(1) in updated:
+                    errors[failed.group(1)] = block['errors']
+                    set_status(failed.group(1), 'failed')
+                    block['remote'], block['errors'] = None, []
+                elif self.REF_UPDATE_RE.match(line):
+                    remote = block['remote'] = get_remote(line.rsplit(' -> ', 1)[1].strip())
+                    if remote and line[1] not in '=!':
+                        updated[remote] += 1
+                        set_status(remote, '%s refs updated' % updated[remote])
+                elif line.strip():
+                    block['errors'].append(line)
+
+        def on_done(exit):
+            if exit != 0 and not errors:
+                # git failed before fetching from any remote
+                errors.update((r, block['errors']) for r in names)
+            for remote in names:
+                if remote in errors:
+                    set_status(remote, 'failed')
+                else:
+                    set_status(remote, '%s refs updated' % updated[remote])
+
+            summary = FETCH_SUMMARY.format(remotes=len(names), time=time.time() - started, failed=len(errors),
+                                           updated=sum(updated[r] for r in names if r not in errors))
+            for remote in names:
+                if errors.get(remote):
+                    summary += u"\n%s:\n%s\n" % (remote, u"\n".join(errors[remote]))
+            self.panel.run_command('git_panel_append', {'content': summary, 'scroll': True})
+            self.warm_ref_catalog(repo)
+
+        # older versions of git fetch from one remote at a time
+        jobs = '--jobs=%s' % max(1, get_setting('git_fetch_jobs', 4)) if self.get_git_version() >= (2, 24) else None
+        job = self.git_async(['fetch', '--multiple', jobs, '-v'] + names, cwd=repo,
+                             on_data=on_data, on_complete=on_done, on_error=on_done,
+                             on_exception=lambda e: on_done(-1))
+        runner = StatusSpinner(job, "Fetching from %s remotes" % len(names))
+        runner.start()
+
 
 class GitPushCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -140,7 +260,7 @@ class GitPushCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.window.show_input_panel('Remote branch:', branch, on_done, noop, noop)
 
     def on_remote_branch(self, repo, branch, remote, merge):
-        cmd = ['push', '-v', remote, '%s:%s' % (branch, merge)]
+        cmd = ['push', '-v', '--progress', remote, '%s:%s' % (branch, merge)]
 
         branch_remote, branch_merge = self.get_branch_upstream(repo, branch)
         if remote != branch_remote or branch_merge != ("refs/heads/%s" % merge):
@@ -155,15 +275,18 @@ class GitPushCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.panel = self.window.get_output_panel('git-push')
         self.panel_shown = False
 
-        thread = self.git_async(cmd, cwd=repo, on_data=self.on_data)
-        runner = StatusSpinner(thread, "Pushing %s to %s" % (branch, remote))
-        runner.start()
+        thread = self.git_async(cmd, cwd=repo, on_data=self.on_data, on_progress=self.on_progress)
+        self.runner = StatusSpinner(thread, "Pushing %s to %s" % (branch, remote))
+        self.runner.start()
 
     def on_data(self, d):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-push'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
 
+    def on_progress(self, event):
+        self.runner.update(event)
+
 
 class GitPullCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -198,18 +321,27 @@ class GitPullCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
         else:
             self.on_remote(repo, branch, remotes[0])
 
-    def on_remote(self, repo, branch, remote):
-        remote_branches = self.get_remote_branches(repo, remote)
+    def on_remote(self, repo, branch, remote, show_all=False):
+        limit = None if show_all else self.get_remote_branch_limit()
+        # ask for one more, to know whether any are left out
+        remote_branches = self.get_remote_branches(repo, remote, limit=limit + 1 if limit else None)
+        more = limit and len(remote_branches) > limit
+        if more:
+            remote_branches = remote_branches[:limit]
         if not remote_branches:
             return sublime.error_message("No branches on remote %s" % remote)
 
         choices = self.format_quick_branches(remote_branches)
+        if more:
+            choices.append([REMOTE_BRANCHES_ALL, REMOTE_BRANCHES_ALL_DESC % limit])
 
         def on_done(idx):
             if idx == -1:
                 return
-            branch = choices[idx][0]
-            self.on_remote_branch(repo, branch, remote, branch)
+            if idx == len(remote_branches):
+                return self.on_remote(repo, branch, remote, show_all=True)
+            remote_branch = choices[idx][0]
+            self.on_remote_branch(repo, remote_branch, remote, remote_branch)
 
         sublime.set_timeout(partial(self.window.show_quick_panel, choices, on_done), 50)
 
@@ -217,17 +349,24 @@ class GitPullCurrentBranchCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.panel = self.window.get_output_panel('git-pull')
         self.panel_shown = False
 
-        cmd = ['pull', '-v', remote, '%s:%s' % (branch, merge)]
+        cmd = ['pull', '-v', '--progress', remote, '%s:%s' % (branch, merge)]
 
-        thread = self.git_async(cmd, cwd=repo, on_data=self.on_data)
-        runner = StatusSpinner(thread, "Pulling %s from %s" % (merge, remote))
-        runner.start()
+        thread = self.git_async(cmd, cwd=repo, on_data=self.on_data, on_progress=self.on_progress,
+                                on_complete=partial(self.on_complete, repo))
+        self.runner = StatusSpinner(thread, "Pulling %s from %s" % (merge, remote))
+        self.runner.start()
 
     def on_data(self, d):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-pull'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
 
+    def on_progress(self, event):
+        self.runner.update(event)
+
+    def on_complete(self, repo, exit_code):
+        self.warm_ref_catalog(repo)
+
 
 class GitPushCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -258,15 +397,19 @@ class GitPushCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.panel = self.window.get_output_panel('git-push')
         self.panel_shown = False
 
-        thread = self.git_async(['push', '-v'], cwd=repo, on_data=self.on_data)
-        runner = StatusSpinner(thread, "Pushing to %s" % (branch_remote))
-        runner.start()
+        thread = self.git_async(['push', '-v', '--progress'], cwd=repo, on_data=self.on_data,
+                                on_progress=self.on_progress)
+        self.runner = StatusSpinner(thread, "Pushing to %s" % (branch_remote))
+        self.runner.start()
 
     def on_data(self, d):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-push'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
 
+    def on_progress(self, event):
+        self.runner.update(event)
+
 
 class GitPullCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -297,15 +440,22 @@ class GitPullCommand(WindowCommand, GitCmd, GitRemoteHelper):
         self.panel = self.window.get_output_panel('git-pull')
         self.panel_shown = False
 
-        thread = self.git_async(['pull', '-v'], cwd=repo, on_data=self.on_data)
-        runner = StatusSpinner(thread, "Pulling from %s" % (branch_remote))
-        runner.start()
+        thread = self.git_async(['pull', '-v', '--progress'], cwd=repo, on_data=self.on_data,
+                                on_progress=self.on_progress, on_complete=partial(self.on_complete, repo))
+        self.runner = StatusSpinner(thread, "Pulling from %s" % (branch_remote))
+        self.runner.start()
 
     def on_data(self, d):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-pull'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
 
+    def on_progress(self, event):
+        self.runner.update(event)
+
+    def on_complete(self, repo, exit_code):
+        self.warm_ref_catalog(repo)
+
 
 class GitRemoteAddCommand(WindowCommand, GitCmd, GitRemoteHelper):
     """
@@ -500,3 +650,105 @@ class GitRemoteCommand(WindowCommand, GitCmd, GitRemoteHelper):
         if not self.panel_shown:
             self.window.run_command('show_panel', {'panel': 'output.git-remote'})
         self.panel.run_command('git_panel_append', {'content': d, 'scroll': True})
+
+
+class GitAutoFetchScheduler(GitCmd, GitRemoteHelper):
+    """
+    Fetches all remotes of the repositories open in each window in the
+    background, every **git_auto_fetch_interval** minutes.
+
+    Start times are spread out randomly, failing repositories are
+    retried with exponential backoff, and nothing is fetched while
+    Sublime Text has not been used for a while.
+    """
+
+    TICK = 60000  # check for work every minute
+    IDLE_TIME = 1800  # seconds without activity before pausing
+    MAX_BACKOFF = 32  # at most 32 intervals between retries
+
+    # next fetch and number of failures, indexed by repo
+    schedule = {}
+    running = set()
+    active = False
+    last_activity = time.time()
+
+    @classmethod
+    def touch(cls):
+        cls.last_activity = time.time()
+
+    @classmethod
+    def start(cls):
+        if not cls.active and get_setting('git_auto_fetch_interval', 0):
+            cls.active = True
+            sublime.set_timeout(cls().tick, cls.TICK)
+
+    # whether ssh should be told not to ask for passwords, set for each fetch
+    batch_mode = False
+
+    def env(self):
+        env = super(GitAutoFetchScheduler, self).env()
+        # never wait for credentials in the background
+        env['GIT_TERMINAL_PROMPT'] = '0'
+        if self.batch_mode and 'GIT_SSH' not in env and 'GIT_SSH_COMMAND' not in env:
+            env['GIT_SSH_COMMAND'] = 'ssh -o BatchMode=yes'
+        return env
+
+    def uses_default_ssh(self, repo):
+        return not self.git_string(['config', '--get', 'core.sshCommand'], cwd=repo)
+
+    def tick(self):
+        interval = get_setting('git_auto_fetch_interval', 0) * 60
+        if not interval:
+            GitAutoFetchScheduler.active = False
+            return
+        sublime.set_timeout(self.tick, self.TICK)
+
+        if time.time() - GitAutoFetchScheduler.last_activity > self.IDLE_TIME:
+            return
+
+        now = time.time()
+        for window in sublime.windows():
+            repo = self.get_repo_from_window(window, silent=True)
+            if not repo or repo in GitAutoFetchScheduler.running:
+                continue
+
+            if repo not in GitAutoFetchScheduler.schedule:
+                # spread out the first fetch, so repositories don't all fetch at once
+                GitAutoFetchScheduler.schedule[repo] = (now + random.uniform(0, interval), 0)
+            elif GitAutoFetchScheduler.schedule[repo][0] <= now:
+                GitAutoFetchScheduler.running.add(repo)
+                self.fetch(repo, interval)
+
+    def fetch(self, repo, interval):
+        # leave a configured ssh command alone
+        self.batch_mode = self.uses_default_ssh(repo)
+        output = []
+        on_done = partial(self.on_fetch, repo, interval, output)
+        job = self.git_async(['fetch', '--all', '--quiet'], cwd=repo, priority=CommandExecutor.BACKGROUND,
+                             on_data=output.append, on_complete=on_done, on_error=on_done,
+                             on_exception=lambda e: on_done(-1))
+        job.start()
+
+    def on_fetch(self, repo, interval, output, exit):
+        GitAutoFetchScheduler.running.discard(repo)
+
+        _, failures = GitAutoFetchScheduler.schedule.get(repo, (0, 0))
+        if exit == 0:
+            failures = 0
+            self.warm_ref_catalog(repo)
+        else:
+            failures += 1
+            logger.warning('Background fetch in %s failed (%s): %s', repo, exit, "".join(output).strip())
+
+        delay = interval * min(2 ** failures, self.MAX_BACKOFF) * random.uniform(0.9, 1.1)
+        GitAutoFetchScheduler.schedule[repo] = (time.time() + delay, failures)
+
+
+class GitAutoFetchEventListener(EventListener):
+
+    def on_activated(self, view):
+        GitAutoFetchScheduler.touch()
+        GitAutoFetchScheduler.start()
+
+    def on_modified(self, view):
+        GitAutoFetchScheduler.touch()
@@ -0,0 +1,52 @@
+# coding: utf-8
+import time
+from functools import partial
+
+import sublime
+from sublime_plugin import WindowCommand
+
+from .cmd import CommandExecutor
+
+
+NO_COMMANDS = "No git commands running"
+
+STOP_COMMAND = u"Stop {command}?"
+
+
+class GitRunningCommandsCommand(WindowCommand):
+    """
+    Show the git commands running in the background
+
+    Lists the fetches, pushes, pulls and other long running commands
+    which are running or waiting for their turn, together with the
+    repository they run in and how long they have been going.
+
+    Selecting a command will ask whether it should be stopped. Commands
+    which haven't started yet are simply dropped, running commands
+    are killed.
+    """
+
+    def run(self):
+        jobs = CommandExecutor.jobs()
+        if not jobs:
+            return sublime.status_message(NO_COMMANDS)
+
+        choices = [[job.description, self.format_state(job)] for job in jobs]
+
+        def on_done(idx):
+            if idx == -1:
+                return
+            job = jobs[idx]
+            if job.is_alive() and sublime.ok_cancel_dialog(STOP_COMMAND.format(command=job.description), 'Stop'):
+                job.cancel()
+
+        sublime.set_timeout(partial(self.window.show_quick_panel, choices, on_done), 0)
+
+    def format_state(self, job):
+        if job.state == job.RUNNING:
+            state = "running for %ds" % (time.time() - job.started_at)
+        else:
+            state = "waiting for %ds" % (time.time() - job.queued_at)
+        if job.priority >= CommandExecutor.BACKGROUND:
+            state += " (background)"
+        return u"%s in %s" % (state, job.repo) if job.repo else state
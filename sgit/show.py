@@ -1,11 +1,13 @@
 # coding: utf-8
+import threading
 from functools import partial
 import sublime
 from sublime_plugin import WindowCommand, TextCommand
 
-from .util import noop, find_view_by_settings
+from .util import noop, find_view_by_settings, get_setting
 from .cmd import GitCmd
 from .helpers import GitShowHelper
+from .diff import GitDiffTextCmd, GitDiffStream
 
 
 GIT_SHOW_TITLE_PREFIX = '*git-show*: '
@@ -14,7 +16,23 @@ GIT_SHOW_SYNTAX = 'Packages/SublimeGit/syntax/SublimeGit Show.tmLanguage'
 
 class GitShowCommand(WindowCommand, GitCmd):
     """
-    Documentation coming soon.
+    Show a commit or other git object.
+
+    For commits, the header and a diffstat are shown right away, and
+    the patch is added in the background. Files with a patch larger
+    than **git_show_max_file_size** bytes are collapsed to a single
+    line, which can be expanded by pressing ``e`` on it.
+
+    The output for full commit shas is cached in memory, so showing
+    the same commit again is instant.
+
+    :setting git_show_max_file_size: Patches larger than this many bytes
+        are collapsed in the show view. Set to ``0`` to never collapse.
+        Defaults to 262144 (256KB).
+    :setting git_show_disk_cache: If set to ``true``, the output of shown
+        commits is also kept in the Sublime Text cache directory, so it
+        survives restarts. Only available in Sublime Text 3.
+
     """
 
     def run(self, repo=None, obj=None):
@@ -52,17 +70,78 @@ class GitShowCommand(WindowCommand, GitCmd):
 
 class GitShowRefreshCommand(TextCommand, GitCmd, GitShowHelper):
 
+    # bounds the number of commits loaded at the same time, when several are shown at once
+    loaders = threading.BoundedSemaphore(4)
+    # the most recent refresh of each view, indexed by view id
+    pending = {}
+
     def is_visible(self):
         return False
 
     def run(self, edit, obj=None):
         obj = obj or self.view.settings().get('git_show_obj')
         repo = self.view.settings().get('git_repo')
-        show = self.get_show(repo, obj)
+
+        token = object()
+        GitShowRefreshCommand.pending[self.view.id()] = token
+
+        worker = self.worker('git_show_disk_cache')
+
+        def load():
+            with GitShowRefreshCommand.loaders:
+                # only commits are shown in stages, everything else is shown in one go
+                if worker.get_cached_show(obj, 'stat') is not None:
+                    commit = obj
+                else:
+                    commit = worker.git_string(['rev-parse', '--verify', '-q', '%s^{commit}' % obj], cwd=repo)
+
+                # the output for a full commit sha never changes
+                cache = commit == obj
+                if commit:
+                    show = worker.get_show_stat(repo, obj, cache=cache).rstrip('\n') + '\n\n'
+                else:
+                    show = worker.get_show(repo, obj)
+            sublime.set_timeout(partial(self.on_show, token, repo, commit, cache, show), 0)
+
+        threading.Thread(target=load).start()
+
+    def on_show(self, token, repo, commit, cache, show):
+        if GitShowRefreshCommand.pending.get(self.view.id()) is not token:
+            return
+        del GitShowRefreshCommand.pending[self.view.id()]
 
         if show:
-            self.view.set_read_only(False)
-            if self.view.size() > 0:
-                self.view.erase(edit, sublime.Region(0, self.view.size()))
-            self.view.insert(edit, 0, show)
-            self.view.set_read_only(True)
+            self.view.run_command('git_diff_write', {'content': show, 'replace': True})
+            self.view.sel().clear()
+            self.view.sel().add(sublime.Region(0))
+
+        if show and commit:
+            threshold = get_setting('git_show_max_file_size', 262144)
+            # the patch is read, and written to the cache, on the stream's thread
+            lines = self.worker('git_show_disk_cache').stream_show_patch(repo, commit, cache=cache)
+            GitDiffStream(self.view, lines, threshold=threshold, append=True).start()
+
+
+class GitShowExpandFileCommand(TextCommand, GitDiffTextCmd, GitShowHelper):
+
+    def is_visible(self):
+        return False
+
+    def is_enabled(self):
+        return self.view.settings().get('git_view') == 'show'
+
+    def run(self, edit):
+        repo = self.view.settings().get('git_repo')
+        obj = self.view.settings().get('git_show_obj')
+
+        collapsed = self.get_collapsed_from_selection(self.view.sel())
+        if not collapsed:
+            return
+
+        # expand from the bottom, so the regions further up stay valid
+        self.view.set_read_only(False)
+        for region, path in reversed(collapsed):
+            patch = self.get_show_patch(repo, obj, path)
+            if patch:
+                self.view.replace(edit, region, patch)
+        self.view.set_read_only(True)
@@ -6,7 +6,7 @@ from sublime_plugin import WindowCommand
 
 from .util import noop
 from .cmd import GitCmd
-from .helpers import GitStashHelper, GitStatusHelper, GitErrorHelper
+from .helpers import GitStashHelper, GitStatusHelper, GitErrorHelper, GitIndexRefreshHelper
 
 
 class GitStashWindowCmd(GitCmd, GitStashHelper, GitErrorHelper):
@@ -41,7 +41,7 @@ class GitStashWindowCmd(GitCmd, GitStashHelper, GitErrorHelper):
         return inner
 
 
-class GitStashCommand(WindowCommand, GitCmd, GitStatusHelper):
+class GitStashCommand(WindowCommand, GitCmd, GitStatusHelper, GitIndexRefreshHelper):
     """
     Documentation coming soon.
     """
@@ -57,7 +57,7 @@ class GitStashCommand(WindowCommand, GitCmd, GitStatusHelper):
             self.window.run_command('git_status', {'refresh_only': True})
 
         # update the index
-        self.git_exit_code(['update-index', '--refresh'], cwd=repo)
+        self.refresh_index(repo)
 
         # get files status
         untracked_files, unstaged_files, _ = self.get_files_status(repo)
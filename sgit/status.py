@@ -1,5 +1,6 @@
 # coding: utf-8
 import os
+import time
 import logging
 import threading
 from functools import partial
@@ -7,9 +8,10 @@ from functools import partial
 import sublime
 from sublime_plugin import WindowCommand, TextCommand, EventListener
 
-from .util import abbreviate_dir, find_view_by_settings, noop, get_setting, get_executable
+from .util import abbreviate_dir, find_view_by_settings, noop, get_setting, StatusSpinner
 from .cmd import GitCmd
-from .helpers import GitStatusHelper, GitRemoteHelper, GitStashHelper, GitErrorHelper
+from .helpers import (GitStatusHelper, GitRemoteHelper, GitStashHelper, GitErrorHelper, GitIndexRefreshHelper,
+                      GitStatusSnapshotHelper, GitStatusCache, GitIndexRefreshCache)
 
 
 logger = logging.getLogger('SublimeGit.status')
@@ -86,16 +88,36 @@ GIT_STATUS_HELP = """
 #    i = ignore file, I = ignore pattern
 #    enter = open file
 #    d = view diff
+#    tab = expand/collapse untracked directory
 #
 # Stashes:
 #    a = apply stash, A = pop stash
 #    z = create stash, Z = create stash including untracked files
 #    backspace = discard stash"""
 
+GIT_STATUS_MORE_ENTRIES = "    (%s more...)\n"
+GIT_STATUS_MORE_ENTRIES_RE = r'^    \(\d+ more\.\.\.\)$'
 
-class GitStatusBuilder(GitCmd, GitStatusHelper, GitRemoteHelper, GitStashHelper):
+GIT_STATUS_DIAGNOSTICS = u"""Repository:           {repo}
+Git:                  {version}
 
-    def build_status(self, repo):
+core.fsmonitor:       {fsmonitor}
+core.untrackedCache:  {untracked_cache}
+core.splitIndex:      {split_index}
+feature.manyFiles:    {many_files}
+git_fast_status:      {fast_status}
+
+Tracked files:        {tracked}
+Status entries:       {entries}
+git status took:      {elapsed:.2f}s
+"""
+
+
+class GitStatusBuilder(GitCmd, GitStatusSnapshotHelper, GitRemoteHelper, GitStashHelper):
+
+    UNTRACKED_CHILDREN_BATCH = 200  # paths per call to git, to keep the command line short
+
+    def build_status(self, repo, expanded=None):
         branch = self.get_current_branch(repo)
         remote = self.get_branch_remote(repo, branch)
         remote_url = self.get_remote_url(repo, remote)
@@ -112,10 +134,10 @@ class GitStatusBuilder(GitCmd, GitStatusHelper, GitRemoteHelper, GitStashHelper)
         status += "\n"
 
         # update index
-        self.git_exit_code(['update-index', '--refresh'], cwd=repo)
+        self.refresh_index(repo)
 
         status += self.build_stashes(repo)
-        status += self.build_files_status(repo)
+        status += self.build_files_status(repo, expanded)
 
         if get_setting('git_show_status_help', True):
             status += GIT_STATUS_HELP
@@ -134,37 +156,90 @@ class GitStatusBuilder(GitCmd, GitStatusHelper, GitRemoteHelper, GitStashHelper)
 
         return status
 
-    def build_files_status(self, repo):
+    def build_files_status(self, repo, expanded=None):
         # get status
         status = ""
-        untracked, unstaged, staged = self.get_files_status(repo)
+        untracked, unstaged, staged = self.get_files_status(repo, self.get_status_snapshot(repo, refresh=True))
+        limit = get_setting('git_status_max_entries', 1000) or None
 
         if not untracked and not unstaged and not staged:
             status += GIT_WORKING_DIR_CLEAN + "\n"
 
         # untracked files
         if untracked:
+            if expanded:
+                untracked = self.expand_untracked(repo, untracked, expanded)
             status += SECTIONS[UNTRACKED_FILES]
-            for s, f in untracked:
+            for s, f in untracked[:limit]:
                 status += "\t%s\n" % f.strip()
+            status += self.build_more_entries(untracked, limit)
             status += "\n"
 
         # unstaged changes
         if unstaged:
             status += SECTIONS[UNSTAGED_CHANGES] if staged else SECTIONS[CHANGES]
-            for s, f in unstaged:
+            for s, f in unstaged[:limit]:
                 status += "\t%s %s\n" % (STATUS_LABELS[s], f)
+            status += self.build_more_entries(unstaged, limit)
             status += "\n"
 
         # staged changes
         if staged:
             status += SECTIONS[STAGED_CHANGES]
-            for s, f in staged:
+            for s, f in staged[:limit]:
                 status += "\t%s %s\n" % (STATUS_LABELS[s], f)
+            status += self.build_more_entries(staged, limit)
             status += "\n"
 
         return status
 
+    def build_more_entries(self, entries, limit):
+        if limit and len(entries) > limit:
+            return GIT_STATUS_MORE_ENTRIES % (len(entries) - limit)
+        return ""
+
+    def get_untracked_children(self, repo, directory):
+        # only ask git again when something may have changed since the directory was expanded
+        key = (repo, directory)
+        fingerprint = (self.get_status_fingerprint(repo),
+                       self.get_stat_fingerprint(os.path.join(repo, directory)))
+        cached = GitStatusCache.children.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        children = self.list_untracked_children(repo, directory)
+        if len(GitStatusCache.children) >= GitStatusCache.max_children:
+            GitStatusCache.children.clear()
+        GitStatusCache.children[key] = (fingerprint, children)
+        return children
+
+    def list_untracked_children(self, repo, directory):
+        # ask git about each entry one level down, so that subdirectories are
+        # collapsed like git does, without walking all of them
+        try:
+            names = sorted(os.listdir(os.path.join(repo, directory)))
+        except OSError:
+            return []
+
+        children = []
+        for i in range(0, len(names), self.UNTRACKED_CHILDREN_BATCH):
+            paths = [directory + n for n in names[i:i + self.UNTRACKED_CHILDREN_BATCH]]
+            output = self.git_string(['--literal-pathspecs', 'ls-files', '-z', '--others', '--exclude-standard',
+                                      '--directory', '--no-empty-directory', '--'] + paths,
+                                     cwd=repo, strip=False)
+            children.extend(p for p in output.split('\x00') if p)
+        return children
+
+    def expand_untracked(self, repo, untracked, expanded):
+        files = []
+        for s, f in untracked:
+            if f in expanded:
+                children = [(s, c) for c in self.get_untracked_children(repo, f)]
+                files.extend(self.expand_untracked(repo, children, expanded))
+            else:
+                files.append((s, f))
+        return files
+
 
 class GitStatusTextCmd(GitCmd):
 
@@ -225,6 +300,10 @@ class GitStatusTextCmd(GitCmd):
         files = self.get_all_file_regions()
         return [(self.section_at_region(f), self.view.substr(f)) for f in files]
 
+    def get_truncated_sections(self):
+        regions = self.view.find_all(GIT_STATUS_MORE_ENTRIES_RE)
+        return set([self.section_at_region(r) for r in regions])
+
     def get_selected_file_regions(self):
         files = []
         lines = self.get_selected_lines()
@@ -517,7 +596,7 @@ class GitStatusRefreshCommand(TextCommand, GitStatusBuilder, GitStatusMoveCmd):
         if not repo:
             return
 
-        status = self.build_status(repo)
+        status = self.build_status(repo, self.view.settings().get('git_status_expanded', []))
         if not status:
             return
 
@@ -541,24 +620,18 @@ class GitStatusEventListener(EventListener):
             view.run_command('git_status_refresh', {'goto': goto})
 
 
-class GitStatusBarUpdater(threading.Thread, GitCmd):
+class GitStatusBarUpdater(threading.Thread, GitCmd, GitIndexRefreshHelper):
     _lpop = False
 
-    def __init__(self, bin, encoding, fallback, repo, kind, view, *args, **kwargs):
+    def __init__(self, settings, repo, kind, view, *args, **kwargs):
         super(GitStatusBarUpdater, self).__init__(*args, **kwargs)
-        self.bin = bin
-        self.encoding = encoding
-        self.fallback = fallback
+        self.cmd_settings = settings
         self.repo = repo
         self.kind = kind
         self.view = view
 
-    def build_command(self, cmd):
-        return self.bin + self.opts + [c for c in cmd if c]
-
     def run(self):
-        branch = self.git_string(['symbolic-ref', '-q', 'HEAD'], cwd=self.repo,
-                                 ignore_errors=True, encoding=self.encoding, fallback=self.fallback)
+        branch = self.git_string(['symbolic-ref', '-q', 'HEAD'], cwd=self.repo, ignore_errors=True)
         if not branch:
             return
 
@@ -567,10 +640,10 @@ class GitStatusBarUpdater(threading.Thread, GitCmd):
         if self.kind == 'simple':
             msg = "On {branch}".format(branch=branch)
         else:
-            self.git_exit_code(['update-index', '--refresh'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
-            unpushed = self.git_exit_code(['diff', '--exit-code', '--quiet', '@{upstream}..'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
-            staged = self.git_exit_code(['diff-index', '--quiet', '--cached', 'HEAD'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
-            unstaged = self.git_exit_code(['diff-index', '--quiet', 'HEAD'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
+            self.refresh_index(self.repo)
+            unpushed = self.git_exit_code(['diff', '--exit-code', '--quiet', '@{upstream}..'], cwd=self.repo)
+            staged = self.git_exit_code(['diff-index', '--quiet', '--cached', 'HEAD'], cwd=self.repo)
+            unstaged = self.git_exit_code(['diff-index', '--quiet', 'HEAD'], cwd=self.repo)
             msg = 'On {branch}{dirty} in {repo}{unpushed}'.format(
                 branch=branch,
                 dirty='*' if (staged or unstaged) else '',
@@ -582,6 +655,13 @@ class GitStatusBarUpdater(threading.Thread, GitCmd):
         # self.view.set_status('git-status', msg)
 
 
+class GitSaveEventListener(EventListener):
+
+    def on_post_save(self, view):
+        # any save may change the working tree of some repository, so count them all
+        GitIndexRefreshCache.saves += 1
+
+
 class GitStatusBarEventListener(EventListener, GitCmd):
     _lpop = False
 
@@ -615,15 +695,11 @@ class GitStatusBarEventListener(EventListener, GitCmd):
         if not repo:
             return
 
-        bin = get_executable('git', self.bin)
-        encoding = get_setting('encoding', 'utf-8')
-        fallback = get_setting('fallback_encodings', [])
-
-        updater = GitStatusBarUpdater(bin, encoding, fallback, repo, kind, view)
+        updater = GitStatusBarUpdater(self.read_settings(), repo, kind, view)
         updater.start()
 
 
-class GitQuickStatusCommand(WindowCommand, GitCmd, GitStatusHelper):
+class GitQuickStatusCommand(WindowCommand, GitCmd, GitStatusSnapshotHelper):
     """
     Show an abbreviated status in the quick bar.
 
@@ -654,7 +730,7 @@ class GitQuickStatusCommand(WindowCommand, GitCmd, GitStatusHelper):
         if not repo:
             return
 
-        status = self.get_porcelain_status(repo)
+        status = self.get_status_snapshot(repo)
         if not status:
             status = [GIT_WORKING_DIR_CLEAN]
 
@@ -675,6 +751,72 @@ class GitQuickStatusCommand(WindowCommand, GitCmd, GitStatusHelper):
         self.window.show_quick_panel(status, on_done, sublime.MONOSPACE_FONT)
 
 
+class GitStatusDiagnosticsCommand(WindowCommand, GitCmd, GitStatusHelper):
+    """
+    Show which features for speeding up git status are in use
+
+    For large working trees, most of the time spent by git status goes
+    to looking for changed files and scanning directories for untracked
+    files. Git can skip most of this work with a file system monitor
+    (**core.fsmonitor**) and an untracked cache (**core.untrackedCache**).
+
+    This command shows whether these and related features are turned on
+    for the current repository, as well as how long git status takes.
+    Setting **git_fast_status** to true will turn on the file system
+    monitor and the untracked cache for all commands run by SublimeGit.
+
+    .. note::
+
+        The built in file system monitor is only available in git 2.36
+        and later, on Windows and OS X. Elsewhere, only the untracked
+        cache will have an effect.
+    """
+
+    def run(self):
+        repo = self.get_repo()
+        if not repo:
+            return
+
+        worker = self.worker('git_status_untracked_files')
+        thread = threading.Thread(target=partial(worker.diagnose, repo))
+        runner = StatusSpinner(thread, "Running git status")
+        runner.start()
+
+    def get_config(self, repo, key):
+        return self.git_string(['config', '--get', key], cwd=repo) or 'not set'
+
+    def get_fsmonitor(self, repo):
+        fsmonitor = self.get_config(repo, 'core.fsmonitor')
+        if fsmonitor.lower() in ('true', 'yes', 'on', '1'):
+            running = self.git_exit_code(['fsmonitor--daemon', 'status'], cwd=repo) == 0
+            return "%s (daemon %s)" % (fsmonitor, 'running' if running else 'not running or not supported')
+        return fsmonitor
+
+    def diagnose(self, repo):
+        started = time.time()
+        entries = len(self.get_porcelain_status(repo))
+        elapsed = time.time() - started
+
+        content = GIT_STATUS_DIAGNOSTICS.format(
+            repo=repo,
+            version=self.git_string(['--version'], cwd=repo),
+            fsmonitor=self.get_fsmonitor(repo),
+            untracked_cache=self.get_config(repo, 'core.untrackedCache'),
+            split_index=self.get_config(repo, 'core.splitIndex'),
+            many_files=self.get_config(repo, 'feature.manyFiles'),
+            fast_status='on' if self.setting('git_fast_status', False) else 'off',
+            tracked=self.git_string(['ls-files', '-z'], cwd=repo, strip=False).count('\x00'),
+            entries=entries,
+            elapsed=elapsed
+        )
+        sublime.set_timeout(partial(self.show_diagnostics, content), 0)
+
+    def show_diagnostics(self, content):
+        panel = self.window.get_output_panel('git-status-diagnostics')
+        panel.run_command('git_panel_write', {'content': content})
+        self.window.run_command('show_panel', {'panel': 'output.git-status-diagnostics'})
+
+
 class GitStatusMoveCommand(TextCommand, GitStatusMoveCmd):
 
     def is_visible(self):
@@ -887,6 +1029,9 @@ class GitStatusIgnoreCommand(TextCommand, GitStatusTextCmd):
 class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
 
     DELETE_UNTRACKED_CONFIRMATION = "Delete all untracked files and directories?"
+    TRUNCATED_SECTION_ERROR = ("Not all changes are shown in the status view, so they can't be "
+                               "discarded from here.\n\nIncrease git_status_max_entries, or discard "
+                               "them from the command line.")
 
     def run(self, edit, discard="item"):
         repo = self.get_repo()
@@ -906,7 +1051,10 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
                 self.discard_all_untracked(repo)
 
             files = [i for i in all_files if i[0] in (UNSTAGED_CHANGES, STAGED_CHANGES)]
-            if files:
+            if files and self.get_truncated_sections() & set([UNSTAGED_CHANGES, STAGED_CHANGES]):
+                # only the files shown would be discarded
+                sublime.error_message(self.TRUNCATED_SECTION_ERROR)
+            elif files:
                 self.discard_files(repo, files)
 
         elif discard == "item":
@@ -1079,3 +1227,25 @@ class GitStatusDiffCommand(TextCommand, GitStatusTextCmd):
             if s != UNTRACKED_FILES:
                 cached = (s == STAGED_CHANGES)
                 window.run_command('git_diff', {'repo': repo, 'path': f, 'cached': cached})
+
+
+class GitStatusExpandCommand(TextCommand, GitStatusTextCmd):
+
+    def run(self, edit):
+        repo = self.get_repo()
+        expanded = self.view.settings().get('git_status_expanded', [])
+
+        files = [f for s, f in self.get_selected_files() if s == UNTRACKED_FILES]
+        for f in files:
+            parents = [d for d in expanded if f.startswith(d)]
+            if f.endswith('/') and f not in expanded:
+                expanded.append(f)
+                # list the directory afresh, later refreshes reuse it while nothing changes
+                GitStatusCache.children.pop((repo, f), None)
+            elif parents:
+                # collapse the closest expanded directory, and everything expanded inside it
+                parent = max(parents, key=len)
+                expanded = [d for d in expanded if not d.startswith(parent)]
+
+        self.view.settings().set('git_status_expanded', expanded)
+        self.update_status("point:%s" % self.get_first_point())
@@ -46,6 +46,14 @@ def find_view_by_settings(window, **kwargs):
 
 # progress helper
 
+def format_size(size):
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    return ('%d %s' if unit == 'bytes' else '%.1f %s') % (size, unit)
+
+
 class StatusSpinner(object):
 
     SIZE = 10  # 10 equal signs
@@ -56,18 +64,39 @@ class StatusSpinner(object):
         self.direction = 1
         self.msg = msg
         self.thread = thread
+        self.event = None
+
+    def update(self, event):
+        """Show a progress event from the command instead of just bouncing."""
+        self.event = event
+
+    def format_event(self, event):
+        parts = ["%s%%" % event['percent'] if event['percent'] is not None else str(event['current'])]
+        if event['bytes'] is not None:
+            parts.append(format_size(event['bytes']))
+        if event['throughput'] is not None:
+            parts.append("%s/s" % format_size(event['throughput']))
+        if event['eta'] is not None:
+            parts.append("%ss left" % event['eta'])
+        return "%s: %s %s" % (self.msg, event['phase'], ", ".join(parts))
 
     def progress(self):
         if not self.thread.is_alive():
             sublime.status_message('')
             return
 
-        left, right = self.counter, (self.SIZE - 1 - self.counter)
-        self.counter += self.direction
-        if self.counter in (0, self.SIZE - 1):
-            self.direction *= -1
+        event = self.event
+        if event and event['percent'] is not None:
+            filled = self.SIZE * event['percent'] // 100
+            status = "[%s%s] %s" % ('=' * filled, ' ' * (self.SIZE - filled), self.format_event(event))
+        else:
+            left, right = self.counter, (self.SIZE - 1 - self.counter)
+            self.counter += self.direction
+            if self.counter in (0, self.SIZE - 1):
+                self.direction *= -1
 
-        status = "[%s=%s] %s" % (' ' * left, ' ' * right, self.msg)
+            msg = self.format_event(event) if event else self.msg
+            status = "[%s=%s] %s" % (' ' * left, ' ' * right, msg)
 
         sublime.status_message(status)
         sublime.set_timeout(self.progress, self.TIME)
@@ -98,10 +127,33 @@ class GitPanelAppendCommand(TextCommand):
         return False
 
     def run(self, edit, content='', scroll=False):
-        self.view.insert(edit, self.view.size(), content)
+        # the last line is still open if it was ended by a carriage return
+        pending = self.view.settings().get('git_panel_pending')
+        if pending or '\r' in content:
+            last = self.view.line(self.view.size())
+            lines = ((pending or self.view.substr(last)) + content).split('\n')
+            self.view.settings().set('git_panel_pending', lines[-1] if '\r' in lines[-1] else None)
+            self.view.replace(edit, last, '\n'.join(self.overwrite(l) for l in lines))
+        else:
+            self.view.insert(edit, self.view.size(), content)
         if scroll:
             self.view.show(self.view.size())
 
+    def overwrite(self, line):
+        # a carriage return starts the line over, like in a terminal
+        parts = [p for p in line.split('\r') if p]
+        return parts[-1] if parts else ''
+
+
+class GitPanelSetLineCommand(TextCommand):
+
+    def is_visible(self):
+        return False
+
+    def run(self, edit, row=0, content=''):
+        line = self.view.line(self.view.text_point(row, 0))
+        self.view.replace(edit, line, content)
+
 
 # Directory helpers
 